@@ -0,0 +1,86 @@
+import gc
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import lambdac.parser as lcp
+import lambdac.reducer as lcr
+import lambdac.prettyprint as pretty
+import lambdac.debruijn as lcdb
+import lambdac.delta as delta
+
+import magma.tokenize as mgt
+import magma.grammar as mgg
+import magma.to_lambda as mgl
+
+# Compiled programs nest one level deeper per line of their blocks (see to_lambda.compose), this times the
+# passes over the lambda term on generated programs of increasing length, with the default recursion limit
+# Usage: python benchmarks/deep_terms.py [line counts...]
+
+def program(lines):
+    # Straight line code over a few variables, every line of it at the top level
+    src = []
+    for i in range(lines):
+        src.append(f"x{i % 5} = x{(i + 1) % 5} + {i % 7}")
+    return "\n".join(src) + "\n"
+
+def depth(term):
+    deepest = 0
+    stack = [(term, 1)]
+    while len(stack) > 0:
+        node, d = stack.pop()
+        deepest = max(deepest, d)
+        term = node.unwrap()
+        if term.type == "lambda":
+            stack.append((term.body, d + 1))
+        elif term.type == "call":
+            stack.append((term.left, d + 1))
+            stack.append((term.right, d + 1))
+    return deepest
+
+# The garbage collector is kept out of the measure: a full collection goes over every node of the large terms
+# (seconds at 8000 lines), and would land in whichever stage happens to trigger it
+def timed(f, *args):
+    gc.collect()
+    gc.disable()
+    try:
+        t0 = time.perf_counter()
+        result = f(*args)
+        return result, time.perf_counter() - t0
+    finally:
+        gc.enable()
+
+def parse(text):
+    return lcp.parse_lambda_term(lcp.Stream(lcp.lex(text)))
+
+def debruijn(tree):
+    store = lcdb.TermStore()
+    return lcdb.to_tree(store, lcdb.from_tree(store, tree))
+
+stages = ["parse", "print", "variables", "substitute", "de Bruijn", "intern", "mark"]
+
+def measure(lines):
+    src = program(lines)
+    text = mgl.compile(mgg.parse_tokens(mgt.tokenize(src)))
+    tree, t_parse = timed(parse, text)
+    _, t_print = timed(pretty.pretty, tree)
+    _, t_variables = timed(lcr.get_variables, tree)
+    # First step of any run: the state is substituted into the whole program
+    _, t_substitute = timed(lcr.beta_reduce, tree)
+    _, t_debruijn = timed(debruijn, tree)
+    # Last, both share and mark the nodes of the tree in place
+    _, t_intern = timed(lcp.InternTable().intern, tree)
+    _, t_mark = timed(delta.mark, tree)
+    return depth(tree), [t_parse, t_print, t_variables, t_substitute, t_debruijn, t_intern, t_mark]
+
+def main():
+    counts = [int(a) for a in sys.argv[1:]] or [250, 500, 1000, 2000, 4000, 8000]
+    print(f"{'lines':>6} {'depth':>7} " + " ".join(f"{stage + ' µs/line':>20}" for stage in stages))
+    for lines in counts:
+        d, times = measure(lines)
+        print(f"{lines:>6} {d:>7} " + " ".join(f"{t / lines * 1e6:>20.1f}" for t in times))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import lambdac.parser as lcp
+import lambdac.binary as lcbin
+
+import magma.tokenize as mgt
+import magma.grammar as mgg
+import magma.to_lambda as mgl
+
+from deep_terms import program
+
+# Startup cost of run.py on generated programs: reading and parsing the text .lc (then interning it, as run does)
+# against loading the binary .lcb, next to the time it takes to only read the file
+# Usage: python benchmarks/load_times.py [line counts...]
+
+def read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def load_text(path):
+    with open(path, "rb") as f:
+        return lcp.InternTable().intern(lcp.parse_lambda_term(lcp.Stream(lcp.tokens(f))))
+
+def timed(f, *args):
+    t0 = time.perf_counter()
+    f(*args)
+    return time.perf_counter() - t0
+
+def main():
+    counts = [int(a) for a in sys.argv[1:]] or [250, 1000, 4000]
+    print(f"{'lines':>6} {'.lc KiB':>9} {'.lcb KiB':>9} {'read ms':>9} {'.lc ms':>9} {'.lcb ms':>9}")
+    with tempfile.TemporaryDirectory() as directory:
+        for lines in counts:
+            text = mgl.compile(mgg.parse_tokens(mgt.tokenize(program(lines))))
+            lc, lcb = os.path.join(directory, "p.lc"), os.path.join(directory, "p.lcb")
+            with open(lc, "w", encoding="utf-8") as f:
+                f.write(text)
+            lcbin.write(load_text(lc), lcb)
+            times = [timed(read_bytes, lc), timed(load_text, lc), timed(lcbin.read, lcb)]
+            print(f"{lines:>6} {os.path.getsize(lc) / 1024:>9.0f} {os.path.getsize(lcb) / 1024:>9.0f} "
+                  + " ".join(f"{t * 1000:>9.1f}" for t in times))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import magma.tokenize as mgt
+import magma.grammar as mgg
+
+# Front end of the compiler on generated programs of increasing length: tokenizing, then parsing the tokens,
+# in µs per line of Magma, which stays flat as both passes are linear in the size of the source
+# Usage: python benchmarks/parse_times.py [line counts...]
+
+# Ten lines with every kind of statement, nested blocks and most operators
+block = """x{i} = {i} + 2 * x{j}
+for i in 1..10
+    if (x{i} % 3 == 0) & !(x{j} < {i})
+        a = [x{i}, x{j} + 1, true]
+    elif x{i} >= 4
+        a @ 1 = (x{i} ** 2) - 1
+    else
+        print a @ 2
+while x{i} != 0
+    x{i} = x{i} / 2
+"""
+
+def program(lines):
+    return "".join(block.format(i=n % 7, j=(n + 1) % 7) for n in range(lines // 10))
+
+def timed(f, *args):
+    t0 = time.perf_counter()
+    result = f(*args)
+    return result, time.perf_counter() - t0
+
+def main():
+    counts = [int(a) for a in sys.argv[1:]] or [1000, 4000, 16000, 64000]
+    print(f"{'lines':>6} {'tokens':>8} {'tokenize µs/line':>18} {'parse µs/line':>15}")
+    for lines in counts:
+        src = program(lines)
+        tokens, t_tokenize = timed(list, mgt.tokenize(src))
+        _, t_parse = timed(mgg.parse_tokens, tokens)
+        print(f"{lines:>6} {len(tokens):>8} {t_tokenize / lines * 1e6:>18.2f} {t_parse / lines * 1e6:>15.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+import glob
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import lambdac.reducer as lcr
+import lambdac.graph as lcg
+import lambdac.debruijn as lcd
+import lambdac.machine as lcm
+import lambdac.nbe as lcn
+import lambdac.parallel as lcpar
+import lambdac.delta as lcdelta
+import lambdac.memo as lcmemo
+import lambdac.stats as lcstats
+
+import magma.tokenize as mgt
+import magma.grammar as mgg
+import magma.to_lambda as mgl
+import magma.optimize as mgo
+
+# Runs the examples and generated programs of growing size with every engine and set of options, recording the
+# steps, the time, the peak memory of the reduction (traced by tracemalloc, in a separate run since tracing slows
+# it down) and the size of the compiled program, in a JSON file
+# Against a baseline (a results file of an earlier run), more steps or a larger program are regressions, and so
+# are time and memory growing by more than the tolerance
+# Usage: python benchmarks/suite.py [--engines=graph,machine] [--configs=plain,delta] [--workloads=examples,fibonacci]
+#        [--sizes=4,8] [--repeat=N] [--max-steps=N] [--timeout=seconds] [--no-memory] [--out=results.json]
+#        [--baseline=baseline.json] [--tolerance=0.25]
+
+engines = {
+    "spine": lcr.SpineReducer,
+    "graph": lcg.GraphReducer,
+    "debruijn": lcd.DeBruijnReducer,
+    "machine": lcm.KrivineMachine,
+    "nbe": lcn.NbEEngine,
+    "bfs": lcr.BFSReducer,
+    "parallel": lcpar.ParallelReducer,
+}
+
+# Options of run.py each configuration runs with
+configs = {
+    "plain": [],
+    "optimize": ["optimize"],
+    "prelude": ["prelude"],
+    "delta": ["delta"],
+    "primitives": ["primitives", "delta"],
+    "memo": ["memo"],
+    "binary": ["binary"],
+    "trees": ["trees"],
+    "binary+trees": ["binary", "trees"],
+}
+
+def fibonacci(n):
+    return "\n".join([
+        f"fibo = 1..{n}",
+        "fibo @ 1 = 1",
+        f"for i in 2..{n - 1}",
+        "    fibo @ i = (fibo @ (i - 1)) + (fibo @ (i - 2))",
+        f"print fibo @ {n - 1}",
+    ]) + "\n"
+
+def nested_loops(n):
+    return "\n".join([
+        "total = 0",
+        f"for i in 1..{n}",
+        f"    for j in 1..{n}",
+        "        if (i + j) % 2 == 0",
+        "            total = total + 1",
+        "print total",
+    ]) + "\n"
+
+def arrays(n):
+    return "\n".join([
+        f"a = 1..{n}",
+        f"for i in 0..{n - 1}",
+        "    a @ i = (a @ i) * 2",
+        "s = 0",
+        "for x in a",
+        "    s = s + x",
+        "print s",
+    ]) + "\n"
+
+# name -> (source of the program of a size, default sizes)
+generated = {
+    "fibonacci": (fibonacci, [6, 10, 14]),
+    "loops": (nested_loops, [3, 5, 7]),
+    "arrays": (arrays, [4, 8, 16]),
+}
+
+def examples():
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "examples")
+    programs = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.mg"))):
+        with open(path) as f:
+            programs.append((os.path.basename(path)[:-3], None, f.read()))
+    return programs
+
+# (workload, size, source) of the programs picked
+def workloads(names, sizes):
+    programs = []
+    for name in names:
+        if name == "examples":
+            programs += examples()
+        else:
+            source, default_sizes = generated[name]
+            programs += [(name, n, source(n)) for n in sizes or default_sizes]
+    return programs
+
+# Reason the engine cannot run the configuration, as run.py would refuse it, or None
+def unsupported(engine, options):
+    for option, feature in [("delta", "delta_rules"), ("memo", "memo")]:
+        if option in options and not getattr(engine, feature):
+            return f"no {option}"
+    return None
+
+def compile_term(source, options):
+    tree = mgg.parse_tokens(mgt.tokenize(source))
+    if "optimize" in options:
+        tree = mgo.optimize(tree)
+    flags = [option in options for option in ["primitives", "prelude", "binary", "trees"]]
+    return tree, flags, mgl.compile_term(tree, *flags)
+
+# Compiled program: bytes of the .lc text and distinct nodes of the term
+def compiled_size(source, options):
+    tree, flags, term = compile_term(source, options)
+    return len(mgl.compile(tree, *flags).encode("utf-8")), lcstats.measure(term)[0]
+
+# Reduces the program as run.py does, returns (steps, seconds, peak bytes, status)
+# Runs are cut after max_steps steps or timeout seconds, the step budget does not stop the nbe engine which
+# normalizes in a single step
+def run_once(source, engine, options, max_steps, timeout, trace=False):
+    _, _, term = compile_term(source, options)
+    if "delta" not in options or not engine.primitives:
+        lcdelta.define_primitives(term)
+    if "delta" in options:
+        lcdelta.mark(term)
+    arguments = {"cache": lcmemo.NormalFormCache(4096)} if "memo" in options else {}
+    if engine is lcpar.ParallelReducer:
+        # As many workers as cores, as run.py
+        arguments.update(workers=0, delta_rules="delta" in options)
+    if trace:
+        tracemalloc.start()
+    t0 = time.perf_counter()
+    reducer = engine(term, **arguments)
+    steps = 0
+    status = "ok"
+    try:
+        while reducer.step():
+            steps += 1
+            if steps >= max_steps:
+                status = "step budget"
+                break
+            if steps % 1024 == 0 and time.perf_counter() - t0 > timeout:
+                status = "timeout"
+                break
+    except RecursionError:
+        status = "recursion"
+    elapsed = time.perf_counter() - t0
+    peak = None
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return getattr(reducer, "steps", steps), elapsed, peak, status
+
+def measure(workload, size, source, engine_name, config, settings):
+    engine, options = engines[engine_name], configs[config]
+    result = {"workload": workload, "size": size, "engine": engine_name, "config": config, "unit": engine.unit}
+    reason = unsupported(engine, options)
+    if reason is not None:
+        result["status"] = f"skipped: {reason}"
+        return result
+    result["compiled_bytes"], result["compiled_nodes"] = compiled_size(source, options)
+    # Fastest of the runs, the noise of the machine only ever adds time
+    times = []
+    for _ in range(settings["repeat"]):
+        steps, elapsed, _, status = run_once(source, engine, options, settings["max_steps"], settings["timeout"])
+        times.append(elapsed)
+        if status != "ok":
+            break
+    result.update({"steps": steps, "time": min(times), "status": status})
+    if settings["memory"] and status == "ok":
+        result["peak_memory"] = run_once(source, engine, options, settings["max_steps"], settings["timeout"], True)[2]
+    return result
+
+def key(result):
+    return (result["workload"], result["size"], result["engine"], result["config"])
+
+# Regressions of results against those of the baseline, as printable lines
+def regressions(results, baseline, tolerance):
+    known = {key(r): r for r in baseline}
+    found = []
+    for r in results:
+        old = known.get(key(r))
+        if old is None or old["status"] != "ok" or r["status"].startswith("skipped"):
+            continue
+        name = f"{r['workload']}" + (f"({r['size']})" if r["size"] is not None else "") + f" {r['engine']} {r['config']}"
+        if r["status"] != "ok":
+            found.append(f"{name}: {r['status']}, was ok")
+            continue
+        for field in ["steps", "compiled_bytes", "compiled_nodes"]:
+            if r[field] > old[field]:
+                found.append(f"{name}: {field} {old[field]} -> {r[field]}")
+        # Short runs are all noise, differences of a few scheduler time slices are not looked at
+        if r["time"] > old["time"] * (1 + tolerance) and r["time"] - old["time"] > 0.05:
+            found.append(f"{name}: time {old['time']:.3f}s -> {r['time']:.3f}s")
+        if r.get("peak_memory") and old.get("peak_memory") and r["peak_memory"] > old["peak_memory"] * (1 + tolerance):
+            found.append(f"{name}: peak memory {old['peak_memory'] // 1024} KiB -> {r['peak_memory'] // 1024} KiB")
+    return found
+
+def row(result):
+    columns = [result["workload"], "" if result["size"] is None else str(result["size"]), result["engine"], result["config"]]
+    line = f"{columns[0]:<18} {columns[1]:>5} {columns[2]:<9} {columns[3]:<12}"
+    if result["status"].startswith("skipped"):
+        return line + f" {result['status']}"
+    memory = result.get("peak_memory")
+    memory = "" if memory is None else f"{memory / 1024:.0f}"
+    return (line + f" {result['steps']:>10} {result['time'] * 1000:>10.1f} {memory:>10} {result['compiled_bytes']:>10}"
+            + f" {result['compiled_nodes']:>8}" + ("" if result["status"] == "ok" else f" {result['status']}"))
+
+def main():
+    options = {}
+    for a in sys.argv[1:]:
+        if a.startswith("--"):
+            name, _, value = a[2:].partition("=")
+            options[name] = value
+    def listed(name, default):
+        return options[name].split(",") if options.get(name) else default
+    settings = {
+        # Timed 3 times by default, the fastest being kept
+        "repeat": int(options.get("repeat") or 3),
+        "max_steps": int(options.get("max-steps") or 2000000),
+        "timeout": float(options.get("timeout") or 60),
+        "memory": "no-memory" not in options,
+    }
+    sizes = [int(n) for n in listed("sizes", [])]
+    programs = workloads(listed("workloads", ["examples"] + list(generated)), sizes)
+    names = listed("engines", ["graph", "debruijn", "machine", "nbe"])
+    chosen = listed("configs", list(configs))
+
+    print(f"{'workload':<18} {'size':>5} {'engine':<9} {'config':<12} {'steps':>10} {'ms':>10} {'peak KiB':>10}"
+          + f" {'.lc bytes':>10} {'nodes':>8}")
+    results = []
+    for workload, size, source in programs:
+        for config in chosen:
+            for engine_name in names:
+                result = measure(workload, size, source, engine_name, config, settings)
+                results.append(result)
+                print(row(result), flush=True)
+
+    out = options.get("out") or "results.json"
+    with open(out, "w") as f:
+        json.dump({"python": platform.python_version(), "machine": platform.machine(), "results": results}, f, indent=1)
+    print(f"Results written to {out}")
+
+    if "baseline" in options:
+        with open(options["baseline"]) as f:
+            baseline = json.load(f)["results"]
+        found = regressions(results, baseline, float(options.get("tolerance") or 0.25))
+        for line in found:
+            print("REGRESSION", line)
+        print(f"{len(found)} regressions against {options['baseline']}")
+        if len(found) > 0:
+            exit(1)
+
+if __name__ == "__main__":
+    main()
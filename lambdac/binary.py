@@ -0,0 +1,129 @@
+import mmap
+import struct
+import sys
+from array import array
+
+from lambdac.parser import *
+from lambdac.reducer import expand_tuple
+
+# Binary format for compiled programs (.lcb), loaded without lexing or parsing anything
+# Header: magic, then the number of names, the size of the name table, the number of nodes and the root node
+# Names: every variable name once, UTF-8, separated by NUL bytes
+# Nodes: tags (one byte each), then left and right (32 bit little endian each), children before their parents
+# A node shared by several parents (see InternTable) is written once and loaded as a single shared node
+# Tuples (native data structures) are written as the chain of pairs they stand for, and indirections as what they
+# lead to, for terms in the middle of a reduction (see lambdac/checkpoint.py)
+
+MAGIC = b"LCB\x01"
+HEADER = struct.Struct("<4sIIII")
+
+VAR = 0 # left: name
+LAM = 1 # left: binder name, right: body
+APP = 2 # left: function, right: argument
+
+def little_endian(a):
+    if sys.byteorder == "big":
+        a.byteswap()
+    return a
+
+def to_bytes(term):
+    names = {}
+    def name_id(name):
+        if name not in names:
+            names[name] = len(names)
+        return names[name]
+
+    ids = {} # id(node) -> index in the table
+    expanded = {} # id(node) -> pair the Tuple in node is written as
+    tag, left, right = array("b"), array("i"), array("i")
+    # Post order on an explicit stack, a node is written once both of its children are
+    stack = [term]
+    while len(stack) > 0:
+        node = stack[-1]
+        if id(node) in ids:
+            stack.pop()
+            continue
+        # Indirections (left by reduction) are written as the node they lead to, which stays shared
+        target = node.deref()
+        if target is not node:
+            if id(target) not in ids:
+                stack.append(target)
+                continue
+            ids[id(node)] = ids[id(target)]
+            stack.pop()
+            continue
+        t = node.term
+        if t.type == "var":
+            tag.append(VAR)
+            left.append(name_id(t.var))
+            right.append(0)
+        elif t.type == "lambda":
+            if id(t.body) not in ids:
+                stack.append(t.body)
+                continue
+            tag.append(LAM)
+            left.append(name_id(t.arg))
+            right.append(ids[id(t.body)])
+        elif t.type == "call":
+            if id(t.left) not in ids or id(t.right) not in ids:
+                stack.append(t.right)
+                stack.append(t.left)
+                continue
+            tag.append(APP)
+            left.append(ids[id(t.left)])
+            right.append(ids[id(t.right)])
+        elif t.type == "tuple":
+            if id(node) not in expanded:
+                expanded[id(node)] = expand_tuple(node)
+            pair = expanded[id(node)]
+            if id(pair) not in ids:
+                stack.append(pair)
+                continue
+            ids[id(node)] = ids[id(pair)]
+            stack.pop()
+            continue
+        else:
+            raise ValueError(f"Cannot serialize a {t.type} term")
+        ids[id(node)] = len(tag) - 1
+        stack.pop()
+
+    name_table = "\0".join(names).encode("utf-8")
+    header = HEADER.pack(MAGIC, len(names), len(name_table), len(tag), ids[id(term)])
+    return header + name_table + tag.tobytes() + little_endian(left).tobytes() + little_endian(right).tobytes()
+
+def from_bytes(data):
+    magic, name_count, name_size, count, root = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a compiled lambda program (.lcb)")
+    # Views of the buffer are released before returning, an mmap cannot be closed while one is around
+    with memoryview(data) as view:
+        offset = HEADER.size
+        names = str(view[offset:offset + name_size], "utf-8").split("\0") if name_count > 0 else []
+        offset += name_size
+        tag, left, right = array("b"), array("i"), array("i")
+        tag.frombytes(view[offset:offset + count])
+        offset += count
+        left.frombytes(view[offset:offset + 4 * count])
+        right.frombytes(view[offset + 4 * count:offset + 8 * count])
+    little_endian(left)
+    little_endian(right)
+
+    nodes = []
+    for i in range(count):
+        t = tag[i]
+        if t == VAR:
+            nodes.append(Node(Variable(names[left[i]])))
+        elif t == LAM:
+            nodes.append(Node(Abstraction(names[left[i]], nodes[right[i]])))
+        else:
+            nodes.append(Node(Application(nodes[left[i]], nodes[right[i]])))
+    return nodes[root]
+
+def write(term, path):
+    with open(path, "wb") as f:
+        f.write(to_bytes(term))
+
+def read(path):
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return from_bytes(data)
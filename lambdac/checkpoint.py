@@ -0,0 +1,34 @@
+import json
+import os
+import struct
+
+import lambdac.binary as lcbin
+
+# Checkpoint of a reduction in progress, resumed later by run.py resume: the term as the engine left it, in the
+# .lcb format, after what it takes to carry on with it (the steps and time so far, the engine and its options)
+# Only engines reducing the term of nodes in place have it in hand between steps (see their checkpoints attribute),
+# a resumed engine starts from the term alone: what it remembered about it (normal subterms, cached normal forms)
+# is found out again, and the delta rules are marked again
+# Header: magic, size of the metadata, then the metadata (JSON) and the term
+
+MAGIC = b"LCK\x01"
+HEADER = struct.Struct("<4sI")
+
+def write(path, term, metadata):
+    meta = json.dumps(metadata).encode("utf-8")
+    data = HEADER.pack(MAGIC, len(meta)) + meta + lcbin.to_bytes(term)
+    # Written to the side first, so that being stopped while writing never loses the previous checkpoint
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+# Returns (term, metadata)
+def read(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, size = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a checkpoint of a reduction")
+    metadata = json.loads(data[HEADER.size:HEADER.size + size].decode("utf-8"))
+    return lcbin.from_bytes(data[HEADER.size + size:]), metadata
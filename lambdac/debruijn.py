@@ -0,0 +1,326 @@
+from array import array
+from lambdac.parser import *
+
+# Compact term representation: de Bruijn indices, one node per slot of parallel integer arrays
+# A term is an integer handle (its slot), so a node costs 14 bytes instead of two Python objects
+
+VAR = 0  # left: de Bruijn index
+LAM = 1  # left: body, right: binder name it was parsed with (index in names), only used to print it back
+APP = 2  # left: function, right: argument
+FREE = 3 # left: name (index in names), for variables bound nowhere in the term
+IND = 4  # left: node this slot has been overwritten with
+
+class TermStore:
+    def __init__(self):
+        self.tag = array("b")
+        self.left = array("i")
+        self.right = array("i")
+        # 1 + highest de Bruijn index pointing outside of the subterm, 0 for closed subterms
+        # Terms can only lose free variables when reduced, so this stays an upper bound after updates
+        self.loose = array("i")
+        self.normal = bytearray()
+        self.names = []
+        self.name_ids = {}
+
+    def __len__(self):
+        return len(self.tag)
+
+    def add(self, tag, left, right, loose):
+        self.tag.append(tag)
+        self.left.append(left)
+        self.right.append(right)
+        self.loose.append(loose)
+        self.normal.append(0)
+        return len(self.tag) - 1
+
+    def name_id(self, name):
+        if name not in self.name_ids:
+            self.name_ids[name] = len(self.names)
+            self.names.append(name)
+        return self.name_ids[name]
+
+    def var(self, index):
+        return self.add(VAR, index, 0, index + 1)
+
+    def lam(self, body, hint):
+        return self.add(LAM, body, hint, max(self.loose[body] - 1, 0))
+
+    def app(self, left, right):
+        return self.add(APP, left, right, max(self.loose[left], self.loose[right]))
+
+    def free(self, name):
+        return self.add(FREE, self.name_id(name), 0, 0)
+
+    def deref(self, h):
+        while self.tag[h] == IND:
+            h = self.left[h]
+        return h
+
+    def overwrite(self, h, new, fresh):
+        # Replace the term in slot h by the one in slot new, for every node pointing to h
+        # Slots allocated before the contraction may be shared, those get an indirection rather than a copy
+        if new < fresh:
+            self.tag[h] = IND
+            self.left[h] = new
+        else:
+            self.tag[h] = self.tag[new]
+            self.left[h] = self.left[new]
+            self.right[h] = self.right[new]
+            self.loose[h] = self.loose[new]
+
+    # The copies below are built in post order on an explicit stack of (slot, depth, built): a LAM or APP slot is
+    # pushed again with built set under its children, and made once their copies are on top of results
+
+    def shift(self, h, d, cutoff=0):
+        # Add d to every index of h pointing above cutoff binders
+        if d == 0:
+            return h
+        results = []
+        stack = [(h, cutoff, False)]
+        while len(stack) > 0:
+            h, cutoff, built = stack.pop()
+            if built:
+                if self.tag[h] == LAM:
+                    results.append(self.lam(results.pop(), self.right[h]))
+                else:
+                    right = results.pop()
+                    results.append(self.app(results.pop(), right))
+                continue
+            h = self.deref(h)
+            tag = self.tag[h]
+            if self.loose[h] <= cutoff:
+                results.append(h)
+            elif tag == VAR:
+                results.append(self.var(self.left[h] + d))
+            elif tag == LAM:
+                stack += [(h, cutoff, True), (self.left[h], cutoff + 1, False)]
+            else:
+                stack += [(h, cutoff, True), (self.right[h], cutoff, False), (self.left[h], cutoff, False)]
+        return results[0]
+
+    def instantiate(self, body, arg):
+        # body[0/arg] for the body of a lambda, decrementing the other loose indices of body
+        # Subterms which do not reference the binder (loose <= depth) are shared, not copied
+        shifted = {}
+        done = {}
+        results = []
+        stack = [(body, 0, False)]
+        while len(stack) > 0:
+            h, depth, built = stack.pop()
+            if built:
+                if self.tag[h] == LAM:
+                    result = self.lam(results.pop(), self.right[h])
+                else:
+                    right = results.pop()
+                    result = self.app(results.pop(), right)
+                done[(h, depth)] = result
+                results.append(result)
+                continue
+            h = self.deref(h)
+            tag = self.tag[h]
+            if self.loose[h] <= depth:
+                results.append(h)
+            elif (h, depth) in done:
+                results.append(done[(h, depth)])
+            elif tag == VAR:
+                index = self.left[h]
+                if index == depth:
+                    if depth not in shifted:
+                        shifted[depth] = self.shift(arg, depth)
+                    result = shifted[depth]
+                else:
+                    result = self.var(index - 1)
+                done[(h, depth)] = result
+                results.append(result)
+            elif tag == LAM:
+                stack += [(h, depth, True), (self.left[h], depth + 1, False)]
+            else:
+                stack += [(h, depth, True), (self.right[h], depth, False), (self.left[h], depth, False)]
+        return results[0]
+
+    def compact(self, roots):
+        # Copy the nodes reachable from roots into fresh arrays, dropping garbage and indirections
+        # Returns the new handles of roots
+        ids = {}
+        order = []
+        stack = [self.deref(r) for r in roots]
+        while len(stack) > 0:
+            h = stack.pop()
+            if h in ids:
+                continue
+            ids[h] = len(order)
+            order.append(h)
+            if self.tag[h] in (LAM, APP):
+                stack.append(self.deref(self.left[h]))
+            if self.tag[h] == APP:
+                stack.append(self.deref(self.right[h]))
+
+        tag, left, right, loose, normal = array("b"), array("i"), array("i"), array("i"), bytearray()
+        for h in order:
+            t = self.tag[h]
+            tag.append(t)
+            left.append(ids[self.deref(self.left[h])] if t in (LAM, APP) else self.left[h])
+            right.append(ids[self.deref(self.right[h])] if t == APP else self.right[h])
+            loose.append(self.loose[h])
+            normal.append(self.normal[h])
+        new_roots = [ids[self.deref(r)] for r in roots]
+        self.tag, self.left, self.right, self.loose, self.normal = tag, left, right, loose, normal
+        return new_roots
+
+# Converts a parsed term into the store, returns its handle
+# Closed subterms shared by several parents (see InternTable) are converted once and stay shared
+# In post order on an explicit stack like TermStore.shift, a binder being in scope from its node being reached
+# until its slot is made
+def from_tree(store, term):
+    scopes = {} # name -> depths of the binders with that name
+    closed = {}
+    results = []
+    stack = [(term, 0, False)]
+    while len(stack) > 0:
+        node, depth, built = stack.pop()
+        term = node.unwrap()
+        if built:
+            if term.type == "lambda":
+                scopes[term.arg].pop()
+                h = store.lam(results.pop(), store.name_id(term.arg))
+            else:
+                right = results.pop()
+                h = store.app(results.pop(), right)
+        elif id(node) in closed:
+            results.append(closed[id(node)])
+            continue
+        elif term.type == "var":
+            if term.var in scopes and len(scopes[term.var]) > 0:
+                h = store.var(depth - 1 - scopes[term.var][-1])
+            else:
+                h = store.free(term.var)
+        elif term.type == "lambda":
+            scopes.setdefault(term.arg, []).append(depth)
+            stack += [(node, depth, True), (term.body, depth + 1, False)]
+            continue
+        else:
+            stack += [(node, depth, True), (term.right, depth, False), (term.left, depth, False)]
+            continue
+        if store.loose[h] == 0:
+            closed[id(node)] = h
+        results.append(h)
+    return results[0]
+
+# Converts a term of the store back into Nodes, reusing the binder names when they do not capture anything
+# The stack holds the slots to convert, and the LAM and APP slots to make a node of once their children are done,
+# as (slot, name): the name given to the binder of a LAM, which is in scope until then, or None for an APP
+def to_tree(store, h):
+    free = set(store.names[store.left[i]] for i in range(len(store)) if store.tag[i] == FREE)
+    scope = []
+    results = []
+    stack = [h]
+    while len(stack) > 0:
+        h = stack.pop()
+        if type(h) is tuple:
+            h, name = h
+            if name is not None:
+                scope.pop()
+                results.append(Node(Abstraction(name, results.pop())))
+            else:
+                right = results.pop()
+                results.append(Node(Application(results.pop(), right)))
+            continue
+        h = store.deref(h)
+        tag = store.tag[h]
+        if tag == VAR:
+            results.append(Node(Variable(scope[-1 - store.left[h]])))
+        elif tag == FREE:
+            results.append(Node(Variable(store.names[store.left[h]])))
+        elif tag == LAM:
+            name = store.names[store.right[h]]
+            if name in free or name in scope:
+                i = 0
+                while f"{name}{i}" in free or f"{name}{i}" in scope:
+                    i += 1
+                name = f"{name}{i}"
+            scope.append(name)
+            stack += [(h, name), store.left[h]]
+        else:
+            stack += [(h, None), store.right[h], store.left[h]]
+    return results[0]
+
+# Normal order reducer over a TermStore, same traversal as SpineReducer but on handles
+# No α-renaming is ever needed, and redex slots are overwritten in place so shared subterms are reduced once
+class DeBruijnReducer:
+    unit = "steps"
+    delta_rules = False
+    primitives = False
+    memo = False
+    telemetry = False
+    profiling = False
+    checkpoints = False
+    budgets = True
+
+    def __init__(self, term):
+        self.store = TermStore()
+        self.root = from_tree(self.store, term)
+        self.focus = self.root
+        self.path = []
+        self.live = len(self.store)
+
+    @property
+    def term(self):
+        return to_tree(self.store, self.root)
+
+    def is_beta_reducible(self, h):
+        store = self.store
+        return store.tag[h] == APP and store.tag[store.deref(store.left[h])] == LAM
+
+    def contract(self, h):
+        store = self.store
+        function = store.deref(store.left[h])
+        fresh = len(store)
+        store.overwrite(h, store.instantiate(store.left[function], store.right[h]), fresh)
+
+    def step(self):
+        store = self.store
+        if len(store) > 2 * self.live + 65536:
+            self.collect()
+        h = self.focus
+        while h is not None:
+            if store.normal[h]:
+                h = self.climb()
+            elif self.is_beta_reducible(h):
+                self.contract(h)
+                h = store.deref(h)
+                if len(self.path) > 0 and self.path[-1][1] == "left" and store.tag[h] == LAM:
+                    h = self.path.pop()[0]
+                self.focus = h
+                return True
+            else:
+                tag = store.tag[h]
+                if tag == LAM:
+                    self.path.append((h, "body"))
+                    h = store.deref(store.left[h])
+                elif tag == APP:
+                    self.path.append((h, "left"))
+                    h = store.deref(store.left[h])
+                else:
+                    h = self.climb()
+        self.focus = None
+        return False
+
+    def climb(self):
+        store = self.store
+        while len(self.path) > 0:
+            parent, side = self.path.pop()
+            if side == "left":
+                self.path.append((parent, "right"))
+                return store.deref(store.right[parent])
+            store.normal[parent] = 1
+        return None
+
+    def collect(self):
+        # Garbage collection: compact the store, keeping the root and the current position in it
+        roots = [self.root] + [h for (h, _) in self.path] + ([self.focus] if self.focus is not None else [])
+        new = self.store.compact(roots)
+        self.root = new[0]
+        self.path = [(h, side) for (h, (_, side)) in zip(new[1:], self.path)]
+        if self.focus is not None:
+            self.focus = new[-1]
+        self.live = len(self.store)
@@ -0,0 +1,260 @@
+from lambdac.parser import *
+import lambdac.stdlib as std
+
+# Delta rules: the stdlib.numbers combinators applied to numerals are computed with Python integers
+# instead of being unfolded into unary arithmetic, in a single step
+# The combinators are recognized in the parsed term (up to α-equivalence) and their nodes marked with the rule,
+# reducers then contract a marked node applied to as many numerals as it takes arguments
+# Arguments are normalized first, which is only safe because compiled programs always give numbers a normal form
+
+def boolean(b):
+    return std.true if b else std.false
+
+# name: (combinator, number of arguments, function computing the result, None to leave the term alone)
+rules = {
+    "iszero": (std.numbers.iszero, 1, lambda n: boolean(n == 0)),
+    "succ": (std.numbers.succ, 1, lambda n: n + 1),
+    "pred": (std.numbers.pred, 1, lambda n: max(n - 1, 0)),
+    "fact": (std.numbers.fact, 1, lambda n: factorial(n)),
+    "add": (std.numbers.add, 2, lambda n, m: n + m),
+    "mult": (std.numbers.mult, 2, lambda n, m: n * m),
+    "sub": (std.numbers.sub, 2, lambda n, m: max(n - m, 0)),
+    "geq": (std.numbers.geq, 2, lambda n, m: boolean(n >= m)),
+    "leq": (std.numbers.leq, 2, lambda n, m: boolean(n <= m)),
+    "ge": (std.numbers.ge, 2, lambda n, m: boolean(n > m)),
+    "le": (std.numbers.le, 2, lambda n, m: boolean(n < m)),
+    "eq": (std.numbers.eq, 2, lambda n, m: boolean(n == m)),
+    # Division by zero loops forever, it is not computed so that it still does
+    "div": (std.numbers.div, 2, lambda n, m: n // m if m > 0 else None),
+    "mod": (std.numbers.mod, 2, lambda n, m: n % m if m > 0 else None),
+}
+
+# Native data structures: with primitives, the stdlib.array and stdlib.linked_list combinators are free variables
+# named after them (stdlib.primitives), computed on Tuple nodes instead of chains of pairs
+# Arguments are "number" (a numeral), "array" or "list" (a Tuple, or a chain of pairs made into one) or any "term"
+def get(t, i):
+    if t.start + i >= len(t.items):
+        return None
+    return t.items[t.start + i]
+
+def set_item(t, i, x):
+    i += t.start
+    if i >= len(t.items):
+        return None
+    return Node(Tuple(t.kind, t.items[t.start:i] + (x,) + t.items[i + 1:]))
+
+def tail(t):
+    if t.start == len(t.items):
+        return None
+    return Node(Tuple(t.kind, t.items, t.start + 1, t.free))
+
+def array_range(n, m):
+    # The combinator never stops if n > m
+    if n > m:
+        return None
+    return Node(Tuple("array", tuple(make_numeral(k) for k in range(n, m + 1))))
+
+def fold(t, g, a):
+    # g (g (g a x0) x1) x2, left for the reducer
+    for x in t.items[t.start:]:
+        a = Node(Application(Node(Application(g, a)), x))
+    return a
+
+primitive_rules = {
+    "$array_get": (("array", "number"), get),
+    "$array_set": (("array", "number", "term"), set_item),
+    "$array_head": (("array",), lambda t: get(t, 0)),
+    "$array_tail": (("array",), tail),
+    "$array_range": (("number", "number"), array_range),
+    "$array_fold": (("array", "term", "term"), fold),
+    "$list_get": (("list", "number"), get),
+    "$list_set": (("list", "number", "term"), set_item),
+}
+
+def argument_kinds(name):
+    if name in primitive_rules:
+        return primitive_rules[name][0]
+    return ("number",) * rules[name][1]
+
+def factorial(n):
+    result = 1
+    for i in range(2, n + 1):
+        result *= i
+    return result
+
+# α-invariant description of a closed term: variables as de Bruijn indices, None if the term is not closed
+# Built on an explicit stack, "λ" and "()" standing for the lambdas and calls whose parts are on top of parts
+def shape(node):
+    scope = []
+    parts = []
+    stack = [node]
+    while len(stack) > 0:
+        node = stack.pop()
+        if node == "λ":
+            scope.pop()
+            parts.append(f"λ{parts.pop()}")
+            continue
+        if type(node) is str:
+            right = parts.pop()
+            parts.append(f"({parts.pop()} {right})")
+            continue
+        term = node.unwrap()
+        if term.type == "var":
+            if term.var not in scope:
+                return None
+            parts.append(str(scope[::-1].index(term.var)))
+        elif term.type == "lambda":
+            scope.append(term.arg)
+            stack += ["λ", term.body]
+        else:
+            stack += ["()", term.right, term.left]
+    return parts[0]
+
+# Size of the term, sizes gets (node, size) for every node in it, shared nodes only once
+# A node is pushed again with built set under its children, and sized once they are
+def size(node, sizes):
+    stack = [(node, False)]
+    while len(stack) > 0:
+        current, built = stack.pop()
+        if id(current) in sizes:
+            continue
+        term = current.unwrap()
+        if built:
+            if term.type == "lambda":
+                result = 1 + sizes[id(term.body)][1]
+            else:
+                result = 1 + sizes[id(term.left)][1] + sizes[id(term.right)][1]
+        elif term.type == "var":
+            result = 1
+        elif term.type == "lambda":
+            stack += [(current, True), (term.body, False)]
+            continue
+        else:
+            stack += [(current, True), (term.right, False), (term.left, False)]
+            continue
+        sizes[id(current)] = (current, result)
+    return sizes[id(node)][1]
+
+shapes = None
+
+# Marks every occurrence of a combinator of rules and of a primitive in the parsed term
+def mark(term):
+    global shapes
+    if shapes is None:
+        shapes = {}
+        for name, (combinator, _, _) in rules.items():
+            combinator = parse_lambda_term(Stream(lex(combinator)))
+            shapes[shape(combinator)] = (name, size(combinator, {}))
+    lengths = set(length for (_, length) in shapes.values())
+    sizes = {}
+    size(term, sizes)
+    for node, length in sizes.values():
+        term = node.unwrap()
+        if term.type == "var" and term.var in primitive_rules:
+            node.delta = term.var
+        # Only subterms of the right size are worth describing
+        elif length in lengths:
+            found = shapes.get(shape(node))
+            if found is not None:
+                node.delta = found[0]
+
+# Returns (rule name, argument nodes) if node applies a marked combinator to exactly its number of arguments
+def match(node):
+    term = node.unwrap()
+    args = []
+    for _ in range(3):
+        if term.type != "call":
+            return None
+        args.insert(0, term.right)
+        head = term.left.deref()
+        if head.delta is not None:
+            return (head.delta, args) if len(argument_kinds(head.delta)) == len(args) else None
+        term = head.unwrap()
+    return None
+
+# Value of the Church numeral λf.λa.f (f ... a), None if the term is not one
+def numeral_value(node):
+    term = node.unwrap()
+    if term.type != "lambda":
+        return None
+    f = term.arg
+    term = term.body.unwrap()
+    if term.type != "lambda" or term.arg == f:
+        return None
+    a = term.arg
+    term = term.body.unwrap()
+    value = 0
+    while term.type == "call":
+        function = term.left.unwrap()
+        if function.type != "var" or function.var != f:
+            return None
+        term = term.right.unwrap()
+        value += 1
+    if term.type != "var" or term.var != a:
+        return None
+    return value
+
+# Value of the bit list λz.λo.λe.o (λz.λo.λe.z (... λz.λo.λe.e)) of stdlib.binary_numbers, lowest bit first,
+# None if the term is not one
+def binary_value(node):
+    value = 0
+    bit = 1
+    while True:
+        binders = []
+        term = node.unwrap()
+        while term.type == "lambda" and len(binders) < 3:
+            binders.append(term.arg)
+            term = term.body.unwrap()
+        if len(binders) < 3 or len(set(binders)) < 3:
+            return None
+        z, o, e = binders
+        if term.type == "var" and term.var == e:
+            return value
+        if term.type != "call":
+            return None
+        function = term.left.unwrap()
+        if function.type != "var" or function.var not in (z, o):
+            return None
+        if function.var == o:
+            value += bit
+        bit *= 2
+        node = term.right
+
+def make_numeral(n):
+    term = Node(Variable("a"))
+    for _ in range(n):
+        term = Node(Application(Node(Variable("f")), term))
+    return Node(Abstraction("f", Node(Abstraction("a", term))))
+
+# Result of the rule on the argument values, as a new term, or None if it should not be applied
+def contract(name, values):
+    if name in primitive_rules:
+        return primitive_rules[name][1](*values)
+    result = rules[name][2](*values)
+    if result is None:
+        return None
+    if isinstance(result, str):
+        return parse_lambda_term(Stream(lex(result)))
+    return make_numeral(result)
+
+# Replaces the primitives of a term by their definitions, for reducers without delta rules for them
+def define_primitives(term):
+    definitions = {}
+    # Shared subterms are only walked once, terms reduced by a graph engine (see run.py resume) share a lot
+    seen = set()
+    stack = [term]
+    while len(stack) > 0:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        term = node.unwrap()
+        if term.type == "var" and term.var in std.primitives:
+            if term.var not in definitions:
+                definitions[term.var] = parse_lambda_term(Stream(lex(std.primitives[term.var])))
+            # Closed terms, every occurrence can share the same one
+            node.deref().update(definitions[term.var])
+        elif term.type == "lambda":
+            stack.append(term.body)
+        elif term.type == "call":
+            stack += [term.right, term.left]
@@ -0,0 +1,71 @@
+from lambdac.parser import *
+from lambdac.reducer import SpineReducer, free_variables, fresh_name
+
+# Substitution f[x/arg] which only rebuilds the parts of term where x occurs free
+# Every occurrence of x points to the very same arg node and the untouched subterms are returned as is,
+# so they stay shared with the original term (and get reduced at most once, for all of their parents)
+# Thanks to the cached free variables, the cost is the size of the rebuilt part, not of the whole term
+# With a tag (when profiling), the rebuilt nodes inherit it as in substitute
+def instantiate(term, x, arg, tag=None):
+    argfree = free_variables(arg)
+    # The term may be a graph, each shared node is only rebuilt once
+    # id(node) -> (node, result), node being kept so that its id is not given to another one while walking
+    done = {}
+    # Built in post order: a node to rebuild is pushed again as (node, body) under its children, body being the
+    # body to take the place of its own for a lambda (with its binder renamed if need be) and None otherwise
+    results = []
+    stack = [term]
+    while len(stack) > 0:
+        node = stack.pop()
+        if type(node) is tuple:
+            node, body = node
+            term = node.unwrap()
+            if term.type == "lambda":
+                result = Node(Abstraction(body.unwrap().arg, results.pop()))
+            elif term.type == "call":
+                right = results.pop()
+                result = Node(Application(results.pop(), right))
+            else:
+                count = len(term.items) - term.start
+                items = tuple(results[len(results) - count:])
+                del results[len(results) - count:]
+                result = Node(Tuple(term.kind, items))
+            if tag is not None:
+                result.tag = inherited_tag(node.deref().tag, tag)
+            done[id(node)] = (node, result)
+            results.append(result)
+            continue
+        if x not in free_variables(node):
+            results.append(node)
+            continue
+        found = done.get(id(node))
+        if found is not None and found[0] is node:
+            results.append(found[1])
+            continue
+        term = node.unwrap()
+        if term.type == "var":
+            # The argument itself, never a copy
+            counters.substituted += 1
+            results.append(arg)
+        elif term.type == "lambda":
+            if term.arg in argfree:
+                v = fresh_name()
+                renamed = Node(Abstraction(v, instantiate(term.body, term.arg, Node(Variable(v)), tag)))
+            else:
+                renamed = node
+            stack += [(node, renamed), renamed.unwrap().body]
+        elif term.type == "call":
+            stack += [(node, None), term.right, term.left]
+        elif term.type == "tuple":
+            stack.append((node, None))
+            stack += reversed(term.items[term.start:])
+    return results[0]
+
+# Lazy graph reducer: normal order, but arguments are never copied
+# A redex node is overwritten by its contractum (possibly an indirection to the shared argument),
+# which is the call-by-need update every other reference to that node sees
+class GraphReducer(SpineReducer):
+    def contract(self, node, tag=None):
+        term = node.unwrap()
+        function = term._left
+        node.update(instantiate(function.body, function.arg, term.right, tag))
@@ -0,0 +1,169 @@
+from lambdac.parser import *
+from lambdac.debruijn import TermStore, from_tree, VAR, LAM, APP, FREE
+
+# Lazy Krivine machine: terms are never substituted into, variables are looked up in environments instead
+# Code is a handle in a TermStore (de Bruijn indices), an environment is a linked list (thunk, next)
+
+# Argument waiting for evaluation, shared by everything referring to it and overwritten once evaluated
+class Thunk:
+    __slots__ = ("code", "env", "value", "normal")
+
+    def __init__(self, code, env, value=None):
+        self.code = code
+        self.env = env
+        self.value = value # Weak head normal form once forced
+        self.normal = None # Read back normal form
+
+# Weak head normal form λ.code in env
+class Closure:
+    __slots__ = ("code", "env")
+
+    def __init__(self, code, env):
+        self.code = code
+        self.env = env
+
+# Weak head normal form x args, where x is free or bound by a lambda being read back
+class Neutral:
+    __slots__ = ("name", "args")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+# Stack marker: the thunk under evaluation above it gets its value when the marker is reached
+class Update:
+    __slots__ = ("thunk",)
+
+    def __init__(self, thunk):
+        self.thunk = thunk
+
+# Evaluates the term to its normal form, by weak head evaluation then read back under lambdas and into arguments
+# Each call to step performs one machine transition
+class KrivineMachine:
+    unit = "transitions"
+    delta_rules = False
+    primitives = False
+    memo = False
+    telemetry = False
+    profiling = False
+    checkpoints = False
+    budgets = True
+
+    def __init__(self, term):
+        self.store = TermStore()
+        self.code = from_tree(self.store, term)
+        store = self.store
+        self.free = set(store.names[store.left[i]] for i in range(len(store)) if store.tag[i] == FREE)
+        self.term = Node(None)
+        self.run = self.normalize()
+
+    def step(self):
+        return next(self.run, False)
+
+    def whnf(self, code, env, stack):
+        tag, left, right = self.store.tag, self.store.left, self.store.right
+        while True:
+            yield True
+            t = tag[code]
+            if t == APP:
+                arg = right[code]
+                if tag[arg] == VAR:
+                    # Pass the thunk itself instead of a thunk pointing to it
+                    e = env
+                    for _ in range(left[arg]):
+                        e = e[1]
+                    stack.append(e[0])
+                else:
+                    stack.append(Thunk(arg, env))
+                code = left[code]
+            elif t == LAM:
+                if len(stack) == 0:
+                    return Closure(code, env)
+                top = stack.pop()
+                if type(top) is Update:
+                    top.thunk.value = Closure(code, env)
+                else:
+                    env = (top, env)
+                    code = left[code]
+            elif t == VAR:
+                e = env
+                for _ in range(left[code]):
+                    e = e[1]
+                thunk = e[0]
+                value = thunk.value
+                if value is None:
+                    stack.append(Update(thunk))
+                    code, env = thunk.code, thunk.env
+                elif type(value) is Closure:
+                    code, env = value.code, value.env
+                else:
+                    return self.neutral(value.name, list(value.args), stack)
+            else:
+                return self.neutral(self.store.names[left[code]], [], stack)
+
+    def neutral(self, name, args, stack):
+        # Nothing left to evaluate: the rest of the stack are arguments of the variable
+        while len(stack) > 0:
+            top = stack.pop()
+            if type(top) is Update:
+                top.thunk.value = Neutral(name, list(args))
+            else:
+                args.append(top)
+        return Neutral(name, args)
+
+    def force(self, thunk):
+        if thunk.value is None:
+            yield from self.whnf(thunk.code, thunk.env, [Update(thunk)])
+        return thunk.value
+
+    def pick_name(self, hint, scope):
+        # Same naming as debruijn.to_tree: keep the binder name unless something in scope would be captured
+        name = hint
+        i = 0
+        while name in self.free or scope.get(name, 0) > 0:
+            name = f"{hint}{i}"
+            i += 1
+        return name
+
+    def normalize(self):
+        # Read back in normal order: head first, then under the lambda, then arguments left to right
+        # The normal form of a thunk is computed once and shared by every place it is read back into
+        names, left, right = self.store.names, self.store.left, self.store.right
+        value = yield from self.whnf(self.code, None, [])
+        tasks = [("value", value, self.term)]
+        scope = {}
+        while len(tasks) > 0:
+            task = tasks.pop()
+            if task[0] == "value":
+                _, value, target = task
+                if type(value) is Closure:
+                    name = self.pick_name(names[right[value.code]], scope)
+                    scope[name] = scope.get(name, 0) + 1
+                    body = Node(None)
+                    target.term = Abstraction(name, body)
+                    env = (Thunk(None, None, Neutral(name, [])), value.env)
+                    body_value = yield from self.whnf(left[value.code], env, [])
+                    tasks.append(("unscope", name))
+                    tasks.append(("value", body_value, body))
+                else:
+                    term = Variable(value.name)
+                    args = []
+                    for thunk in value.args:
+                        arg = Node(None)
+                        args.append((thunk, arg))
+                        term = Application(Node(term), arg)
+                    target.term = term
+                    for (thunk, arg) in args[::-1]:
+                        tasks.append(("thunk", thunk, arg))
+            elif task[0] == "thunk":
+                _, thunk, target = task
+                if thunk.normal is not None:
+                    target.term = thunk.normal
+                    continue
+                value = yield from self.force(thunk)
+                tasks.append(("memo", thunk, target))
+                tasks.append(("value", value, target))
+            elif task[0] == "memo":
+                task[1].normal = task[2]
+            elif task[0] == "unscope":
+                scope[task[1]] -= 1
@@ -0,0 +1,43 @@
+from collections import OrderedDict
+
+from lambdac.parser import *
+
+# Normal forms of closed subterms, reused when the same subterm shows up again (`eq` on the same numerals in
+# every iteration of a loop, say) instead of reducing it once more
+# Terms are identified by their InternTable key id, without binder names since reducers rename them as they go,
+# and only the size most recently used ones are kept
+# A key may describe a node as it was before some of its subterms were reduced in place, which is still
+# the same normal form
+class NormalFormCache:
+    def __init__(self, size=4096):
+        self.size = size
+        self.table = InternTable(names=False)
+        self.normal_forms = OrderedDict() # key id -> node holding its normal form, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Key id of the closed term in node, None if it has none
+    def key(self, node):
+        # The table of key ids only ever grows, it is dropped once much larger than the cache
+        # Ids are never reused, so the keys already given out only stop matching anything
+        if len(self.table.ids) > 16 * self.size:
+            self.table.ids.clear()
+        return self.table.key(node)
+
+    # Node holding the normal form of the term with this key, None if it is not known
+    def get(self, key):
+        found = self.normal_forms.get(key)
+        if found is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.normal_forms.move_to_end(key)
+        return found
+
+    def store(self, key, node):
+        self.normal_forms[key] = node
+        self.normal_forms.move_to_end(key)
+        if len(self.normal_forms) > self.size:
+            self.normal_forms.popitem(last=False)
+            self.evictions += 1
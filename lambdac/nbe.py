@@ -0,0 +1,219 @@
+import sys
+
+from lambdac.parser import *
+import lambdac.delta as delta
+
+# Normalization by evaluation: the term is compiled into Python closures, evaluated with Python function calls,
+# and the value it evaluates to is read back into a term in normal form
+# A value is either a Python function taking a Thunk (for lambdas), or a Neutral
+
+# Delayed argument, evaluated at most once however many times the function uses it
+class Thunk:
+    __slots__ = ("code", "env", "value", "normal")
+
+    def __init__(self, code, env, value=None):
+        self.code = code
+        self.env = env
+        self.value = value
+        self.normal = None # Read back normal form
+
+    def force(self):
+        if self.code is not None:
+            self.value = self.code(self.env)
+            self.code = self.env = None
+        return self.value
+
+# Variable with no value (free, or bound by a lambda being read back) applied to arguments (thunks)
+class Neutral:
+    __slots__ = ("name", "args")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+# Environments are linked lists (thunk, next), the variable at de Bruijn index i is i links away
+def lookup(index):
+    if index == 0:
+        return lambda env: env[0]
+    if index == 1:
+        return lambda env: env[1][0]
+    def find(env):
+        for _ in range(index):
+            env = env[1]
+        return env[0]
+    return find
+
+def apply(f, thunk):
+    if type(f) is Neutral:
+        return Neutral(f.name, f.args + (thunk,))
+    return f(thunk)
+
+# Unique variables (their names are no strings), to find the number n a value stands for from λf.λa.f (f ... a)
+PROBE_F = Neutral(object(), ())
+PROBE_A = Neutral(object(), ())
+def numeral_value(value):
+    x = apply(apply(value, Thunk(None, None, PROBE_F)), Thunk(None, None, PROBE_A))
+    n = 0
+    while type(x) is Neutral and x.name is PROBE_F.name and len(x.args) == 1:
+        x = x.args[0].force()
+        n += 1
+    return n if x is PROBE_A else None
+
+# Marked combinator: computed natively if its arguments are numerals, by its definition otherwise
+def compile_delta(node, free, counter):
+    rule = node.delta
+    definition = compile_term(node.term, free, counter)
+    def run(thunks):
+        values = [numeral_value(thunk.force()) for thunk in thunks]
+        if None not in values:
+            result = delta.contract(rule, values)
+            if result is not None:
+                counter[0] += 1
+                return compile_term(result, free, counter)(None)
+        value = definition(None)
+        for thunk in thunks:
+            value = apply(value, thunk)
+        return value
+    if delta.rules[rule][1] == 1:
+        return lambda env: lambda n, hint="n": run((n,))
+    return lambda env: lambda n, hint="n": lambda m, hint="m": run((n, m))
+
+# Code of the terms, made by functions so that each closure gets its own arguments
+
+def variable_code(find):
+    return lambda env: find(env).force()
+
+def constant_code(value):
+    return lambda env: value
+
+def lambda_code(body, hint):
+    # The binder name rides along as a default argument, read_back uses it to name the variable
+    return lambda env: lambda arg, hint=hint: body((arg, env))
+
+def thunk_code(code):
+    return lambda env: Thunk(code, env)
+
+def call_code(function, argument, counter):
+    def call(env):
+        f = function(env)
+        if type(f) is Neutral:
+            return Neutral(f.name, f.args + (argument(env),))
+        counter[0] += 1
+        return f(argument(env))
+    return call
+
+# Compiles the term into a function from environments to values, free collects the names of the free variables
+# Bottom up on an explicit stack: a lambda or a call is pushed again with built set under its parts, a binder being
+# in scope until then, and compiled once their code is on top of results
+def compile_term(node, free, counter):
+    scopes = {} # name -> depths of the binders with that name
+    results = []
+    stack = [(node, 0, False)]
+    while len(stack) > 0:
+        node, depth, built = stack.pop()
+        term = node.unwrap()
+        if built:
+            if term.type == "lambda":
+                scopes[term.arg].pop()
+                results.append(lambda_code(results.pop(), term.arg))
+            else:
+                argument = depth
+                if argument is None:
+                    argument = thunk_code(results.pop())
+                results.append(call_code(results.pop(), argument, counter))
+        elif node.type == "node" and node.delta is not None:
+            results.append(compile_delta(node, free, counter))
+        elif term.type == "var":
+            if len(scopes.get(term.var, [])) > 0:
+                results.append(variable_code(lookup(depth - 1 - scopes[term.var][-1])))
+            else:
+                free.add(term.var)
+                results.append(constant_code(Neutral(term.var, ())))
+        elif term.type == "lambda":
+            scopes.setdefault(term.arg, []).append(depth)
+            stack += [(node, depth, True), (term.body, depth + 1, False)]
+        elif term.type == "call":
+            right = term.right.unwrap()
+            if right.type == "var" and len(scopes.get(right.var, [])) > 0:
+                # Pass the variable's thunk itself, so that it is still only evaluated once
+                # (given in place of the depth to the frame building the call)
+                stack += [(node, lookup(depth - 1 - scopes[right.var][-1]), True), (term.left, depth, False)]
+            else:
+                stack += [(node, None, True), (term.right, depth, False), (term.left, depth, False)]
+    return results[0]
+
+# Normal order: head first, then under the lambda, then arguments left to right
+# The stack holds the values to read back and, below what they are read back into, the neutrals and lambdas
+# waiting on them and the thunks to keep their normal forms
+def read_back(value, free):
+    scope = {} # name -> number of the lambdas being read back binding it
+    results = []
+    stack = [("value", value)]
+    while len(stack) > 0:
+        kind, value = stack.pop()
+        if kind == "thunk":
+            # A thunk shared by several places is read back once, variables it mentions are bound above all of them
+            if value.normal is None:
+                stack += [("normal", value), ("value", value.force())]
+        elif kind == "normal":
+            value.normal = results.pop()
+        elif kind == "neutral":
+            term = Variable(value.name)
+            for thunk in value.args:
+                term = Application(Node(term), thunk.normal)
+            results.append(Node(term))
+        elif kind == "lambda":
+            scope[value] -= 1
+            results.append(Node(Abstraction(value, results.pop())))
+        elif type(value) is Neutral:
+            stack.append(("neutral", value))
+            stack += [("thunk", thunk) for thunk in reversed(value.args)]
+        else:
+            # Apply the function to a fresh variable, named like debruijn.to_tree would
+            hint = value.__defaults__[0]
+            name = hint
+            i = 0
+            while name in free or scope.get(name, 0) > 0:
+                name = f"{hint}{i}"
+                i += 1
+            scope[name] = scope.get(name, 0) + 1
+            stack += [("lambda", name), ("value", value(Thunk(None, None, Neutral(name, ()))))]
+    return results[0]
+
+# Recursion limit while evaluating
+EVALUATION_DEPTH = 1000000
+
+# Computes the whole normal form in its first step, steps counts the β-reductions (function calls) it took
+# and the delta rules it applied
+class NbEEngine:
+    unit = "β-reductions"
+    delta_rules = True
+    primitives = False
+    memo = False
+    telemetry = False
+    profiling = False
+    checkpoints = False
+    budgets = False
+
+    def __init__(self, term):
+        self.term = term
+        self.steps = 0
+        self.done = False
+
+    def step(self):
+        if self.done:
+            return False
+        # Evaluation is the compiled closures calling each other, as deep as the chains of calls in the term: the
+        # recursion limit is only raised while it runs
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(limit, EVALUATION_DEPTH))
+        try:
+            counter = [0]
+            free = set()
+            code = compile_term(self.term, free, counter)
+            self.term = read_back(code(None), free)
+        finally:
+            sys.setrecursionlimit(limit)
+        self.steps = counter[0]
+        self.done = True
+        return False
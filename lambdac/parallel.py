@@ -0,0 +1,131 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from lambdac.parser import *
+from lambdac.graph import GraphReducer
+import lambdac.binary as lcbin
+import lambdac.delta as delta
+
+# Graph reducer handing the arguments of neutral applications to worker processes
+# Once the spine reaches a head which is not a function (a variable, or a subterm already normal), the term is
+# x a1 ... an and nothing can happen to it but each ai being normalized on its own. As this reducer moves on to
+# the next argument ai, those after it which are independent of the others are sent to a pool of processes, in the
+# .lcb format of lambdac/binary.py, and spliced back, normal, once the reduction gets to them
+# Independent means that none of the nodes left to reduce in the argument are shared with another argument: a
+# worker would do that shared work again, and the compiled programs share a lot (the memory and the printed values
+# are read from the same state). Normalizing ai first often evaluates what it shares with the next ones in place,
+# which is why the arguments are looked at again before each of them
+# The result is the same as with the graph engine, and so is the count of steps (the steps of the workers included,
+# it is only known once the run is over, see steps) unless an argument shares work with the rest of the term, or
+# holds native data structures of the delta rules, which are sent as pairs and made into Tuples again
+
+# Normal form of the term in data, in the same format, and the steps it took, run in a worker
+def normalize(data, delta_rules):
+    term = lcbin.from_bytes(data)
+    if delta_rules:
+        # Marks do not survive serialization
+        delta.mark(term)
+    reducer = GraphReducer(term)
+    steps = 0
+    while reducer.step():
+        steps += 1
+    return lcbin.to_bytes(reducer.term), steps
+
+# ids of the nodes reachable from node which are not known to be in normal form, variables aside
+def unreduced(node):
+    found = set()
+    stack = [node]
+    while len(stack) > 0:
+        node = stack.pop().deref()
+        if node.normal or id(node) in found:
+            continue
+        term = node.term
+        if term.type == "var":
+            # Never marked normal, and shared by the interned terms
+            continue
+        found.add(id(node))
+        if term.type == "lambda":
+            stack.append(term.body)
+        elif term.type == "call":
+            stack += [term.left, term.right]
+        elif term.type == "tuple":
+            stack += term.items[term.start:]
+    return found
+
+class ParallelReducer(GraphReducer):
+    memo = False
+    telemetry = False
+    profiling = False
+    # Workers are not stopped by budgets, and what they are doing is not in the term to be saved
+    checkpoints = False
+    budgets = False
+
+    # workers processes (all the cores by default), sent the arguments with at least grain nodes left to reduce,
+    # delta_rules telling them to mark the terms they get
+    # The reducers of the arguments of delta rules (see contract_delta) have no pool and work alone
+    def __init__(self, term, until_tuple=False, cache=None, stats=None, profile=None, workers=None, grain=64,
+                 delta_rules=False):
+        super().__init__(term, until_tuple, cache, stats, profile)
+        self.pool = None
+        if workers is not None:
+            self.pool = ProcessPoolExecutor(workers or os.cpu_count())
+        self.grain = grain
+        self.delta_rules = delta_rules
+        # id(node) -> (node, future) of the arguments being normalized by a worker
+        self.shipped = {}
+        # Steps done here and by the workers
+        self.steps = 0
+
+    def step(self):
+        if super().step():
+            self.steps += 1
+            return True
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+        return False
+
+    def ship(self, node):
+        # node is the argument being moved on to, the path ends with its application and those of the head to the
+        # arguments after it
+        args = [node]
+        for parent, side in reversed(self.path[:-1]):
+            if side != "left":
+                break
+            arg = parent.unwrap().right.deref()
+            if not arg.normal and id(arg) not in self.shipped:
+                args.append(arg)
+        if len(args) < 2:
+            return
+        found = [unreduced(arg) for arg in args]
+        shared = set()
+        seen = set()
+        for ids in found:
+            shared |= seen & ids
+            seen |= ids
+        # node itself is normalized here, next in normal order
+        for arg, ids in zip(args[1:], found[1:]):
+            if len(ids) >= self.grain and ids.isdisjoint(shared):
+                future = self.pool.submit(normalize, lcbin.to_bytes(arg), self.delta_rules)
+                self.shipped[id(arg)] = (arg, future)
+
+    def splice(self, node):
+        _, future = self.shipped.pop(id(node))
+        data, steps = future.result()
+        result = lcbin.from_bytes(data)
+        if self.delta_rules:
+            delta.mark(result)
+        result.normal = True
+        node.update(result)
+        node.normal = True
+        self.steps += steps
+        return result
+
+    def climb(self):
+        node = super().climb()
+        if node is not None and id(node) in self.shipped:
+            # Waits for the worker if it is not done yet
+            return self.splice(node)
+        if node is not None and self.pool is not None:
+            self.ship(node)
+        return node
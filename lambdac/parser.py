@@ -1,26 +1,60 @@
-import string
+import itertools
+import mmap
+import re
 from collections import deque
 
+# Tokens are the punctuation ( ) λ . and names, anything else only separates them
+TOKEN = re.compile(r"[()λ.]|[A-Za-z0-9_$]+")
+BYTES_TOKEN = re.compile(rb"[().]|\xce\xbb|[A-Za-z0-9_$]+") # Same, on UTF-8 encoded text
+
+# The source as pieces of text: slices of it if it is already in memory (a string, bytes or an mmap),
+# chunks read from it if it is a file, as the tokens are needed
+def chunks(source, size):
+    if isinstance(source, (str, bytes, bytearray, mmap.mmap)):
+        for i in range(0, len(source), size):
+            yield source[i:i + size]
+        return
+    while True:
+        chunk = source.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+# Tokens of a piece of text, names keeps the tokens already decoded from bytes
+def find_tokens(text, names):
+    if isinstance(text, str):
+        return TOKEN.findall(text)
+    found = []
+    for token in BYTES_TOKEN.findall(text):
+        if token not in names:
+            names[token] = token.decode("utf-8")
+        found.append(names[token])
+    return found
+
+# Characters which may be followed by more of the same token, in text and in UTF-8 (where a λ is two bytes)
+NAME = set("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_$")
+BYTES_NAME = set(c.encode("ascii")[0] for c in NAME) | set(range(0x80, 0x100))
+
+# Yields the tokens of source, a string or bytes, an mmap or a file opened in text or binary mode
+# Only a chunk of it is looked at at once: the end of it may be cut in two (a name, or the bytes of a λ), it is kept
+# for the next chunk from the last character which ends a token whatever follows (a space, a newline, punctuation)
+def tokens(source, chunk_size=1 << 16):
+    names = {}
+    rest = None
+    for chunk in chunks(source, chunk_size):
+        if rest:
+            chunk = rest + chunk
+        unfinished = NAME if isinstance(chunk, str) else BYTES_NAME
+        cut = len(chunk)
+        while cut > 0 and chunk[cut - 1] in unfinished:
+            cut -= 1
+        rest = chunk[cut:]
+        yield from find_tokens(chunk[:cut], names)
+    if rest:
+        yield from find_tokens(rest, names)
+
 def lex(src):
-    tokens = []
-    buffer = ""
-
-    for c in src:
-        if c in ["(", ")", ".", "λ"]:
-            if buffer != "":
-                tokens.append(buffer)
-                buffer = ""
-            tokens.append(c)
-        if c in string.whitespace:
-            if buffer != "":
-                tokens.append(buffer)
-                buffer = ""
-        if c in string.ascii_letters + "_" + string.digits:
-            buffer += c
-
-    if buffer != "":
-        tokens.append(buffer)
-    return tokens
+    return list(tokens(src))
 
 PUNC = "()λ."
 VAR = "var"
@@ -36,16 +70,69 @@ class LambdaTerm:
     def _type(self):
         return self.unwrap().type
 
+# Totals of the work done on terms since the program started, read by lambdac/stats.py
+class counters:
+    nodes = 0 # Nodes allocated
+    renames = 0 # Binders renamed to a fresh variable to avoid a capture
+    substituted = 0 # Variable occurrences replaced by the argument of a β-step
+
+    # The three totals so far, in this order
+    @staticmethod
+    def total():
+        return [counters.nodes, counters.renames, counters.substituted]
+
 # Mutable wrappers for lambda terms to allow for in place reduction within a tree
+# A node may be shared by several parents, in which case updating it updates the term everywhere it occurs
 class Node(LambdaTerm):
+    # (line, origin) of the Magma code the node comes from, see lambdac/profiler.py
+    # Only tagged nodes have their own, untagged ones cost nothing more
+    tag = None
+    # Id of the term in an InternTable leaving binder names out (see NormalFormCache), kept apart from key since
+    # the ids of the two kinds of tables do not match; only the nodes given one have their own
+    alpha_key = None
+
     def __init__(self, term):
         self.term: LambdaTerm = term
         self.type = "node"
+        # Set once the reducer knows there is nothing left to reduce inside
+        self.normal = False
+        # Cached free variables of the term, see reducer.free_variables
+        self.free = None
+        # Name of the delta rule computing this combinator, see delta.mark
+        self.delta = None
+        # Id of the term in an InternTable, equal ids meaning identical terms
+        self.key = None
+        counters.nodes += 1
+
+    # Follows indirections (nodes pointing to nodes) to the node actually holding the term
+    def deref(self):
+        while self.term.type == "node":
+            self = self.term
+        return self
+
+    # In place reduction: replace the term, dropping what was cached about the old one
+    # An interned node keeps being shared (every parent sees the same reduct), but is not identical to its key anymore
+    def update(self, term):
+        self.term = term
+        self.free = None
+        self.key = None
+        if self.alpha_key is not None:
+            self.alpha_key = None
+
+# Tag of a copy of a node tagged own, made by a step tagged context: what the node does not know comes from the step
+def inherited_tag(own, context):
+    if own is None:
+        return context
+    return (own[0] if own[0] is not None else context[0], own[1] if own[1] is not None else context[1])
+
+# Every variable name ever created, so that fresh names never collide with one of them
+names_in_use = set()
 
 class Variable(LambdaTerm):
     def __init__(self, var):
         self.type = "var"
         self.var: str = var
+        names_in_use.add(var)
 
 # Represents λarg.body
 class Abstraction(LambdaTerm):
@@ -73,54 +160,186 @@ class Application(LambdaTerm):
     def _right(self):
         return self.right.unwrap()
 
+# Primitive data structure, items[start:] in one node instead of a chain of pairs
+# Only built by the delta rules of lambdac/delta.py, reducers expand it back into pairs as far as it is looked at
+# kind is the encoding it stands for, "array" (stdlib.array) or "list" (stdlib.linked_list)
+class Tuple(LambdaTerm):
+    def __init__(self, kind, items, start=0, free=None):
+        self.type = "tuple"
+        self.kind = kind
+        self.items = items
+        self.start = start
+        # Free variables of all of items, shared with the tails of this tuple
+        self.free = free
+
+# Tokens read one at a time from any iterable of them, with one token of lookahead
 class Stream:
-    def __init__(self, tokenlist):
-        self.tokens = tokenlist + ["EOF"]
+    def __init__(self, tokens):
+        self.tokens = iter(tokens)
+        self.peek = next(self.tokens, "EOF")
         self.depth = 0
 
     def consume(self):
+        token = self.peek
+        self.peek = next(self.tokens, "EOF")
         self.depth += 1
-        return self.tokens[self.depth - 1]
+        return token
 
     def expect(self, typ):
         if typ in PUNC:
-            assert self.tokens[self.depth] == typ
+            assert self.peek == typ
         if typ == VAR:
-            assert self.tokens[self.depth] not in PUNC
+            assert self.peek not in PUNC
         return self.consume()
-    
-    @property
-    def peek(self):
-        return self.tokens[self.depth]
 
 # Turn f g h t into (((f g) h) t), or with more functions
 def call_collapse(terms):
-    if len(terms) == 2:
-        return Node(Application(terms[0], terms[1]))
-    else:
-        return Node(Application(call_collapse(terms[:-1]), terms[-1]))
+    term = terms[0]
+    for t in terms[1:]:
+        term = Node(Application(term, t))
+    return term
 
 # Parse any lambda expression
+# A λ takes everything up to the end of the parentheses it is in as its body, so the term is read with an explicit
+# stack of the sequences being read, ("root"|"paren"|"lambda", binder name, terms): nesting is only limited by memory
 def parse_lambda_term(stream):
-    if stream.peek == "λ":
-        stream.expect("λ")
-        varname = stream.expect(VAR)
-        stream.expect(".")
-        body = parse_lambda_term(stream)
-        return Node(Abstraction(varname, body))
-    else:
-        terms = []
-        while stream.peek not in [")", "EOF"]:
-            if stream.peek == "(":
-                stream.expect("(")
-                terms.append(parse_lambda_term(stream))
-                stream.expect(")")
-            elif stream.peek not in PUNC:
-                terms.append(Node(Variable(stream.expect(VAR))))
-            elif stream.peek == "λ":
-                terms.append(parse_lambda_term(stream))
-        
-        if len(terms) == 1:
-            return terms[0]
+    frames = [("root", None, [])]
+    while True:
+        if stream.peek == "λ":
+            stream.expect("λ")
+            varname = stream.expect(VAR)
+            stream.expect(".")
+            frames.append(("lambda", varname, []))
+        elif stream.peek == "(":
+            stream.expect("(")
+            frames.append(("paren", None, []))
+        elif stream.peek not in [")", "EOF"]:
+            frames[-1][2].append(Node(Variable(stream.expect(VAR))))
         else:
-            return call_collapse(terms)
\ No newline at end of file
+            # End of the innermost sequence, and of the bodies of the λs just before it
+            kind, varname, terms = frames.pop()
+            assert len(terms) > 0
+            term = call_collapse(terms)
+            while kind == "lambda":
+                term = Node(Abstraction(varname, term))
+                kind, varname, terms = frames.pop()
+                terms.append(term)
+                term = call_collapse(terms)
+            if kind == "root":
+                return term
+            stream.expect(")")
+            frames[-1][2].append(term)
+
+# Hash-consing: structurally identical closed subterms are made into a single shared node
+# A key is built from the ids of the keys of the children, so interning costs O(1) per node,
+# and two interned nodes are the same term exactly when their keys are equal
+# Ids are never reused, even across tables, so that a key stays meaningful after its table is dropped
+key_ids = itertools.count()
+
+# With names False, binder names are left out of the keys: α-equivalent terms get the same key
+# The key ids of the closed subterms are kept on their nodes, in key or in alpha_key without names
+class InternTable:
+    def __init__(self, names=True):
+        self.ids = {}
+        self.nodes = {} # id -> shared node
+        self.names = names
+        self.attribute = "key" if names else "alpha_key"
+
+    def key_id(self, key):
+        if key not in self.ids:
+            self.ids[key] = next(key_ids)
+        return self.ids[key]
+
+    # Both walk the term in post order on an explicit stack like parse_lambda_term's frames: a lambda or a call is
+    # pushed again with built set under its children, a binder being in scope until then, and gets its key once
+    # theirs are on top of results
+
+    # Key id of the closed term in node, None if it holds a Tuple
+    # The ids of the closed subterms are kept on their nodes, for the next time they are asked for
+    def key(self, node):
+        scopes = {}
+        # (key id, loose) of the subterms done, like intern
+        results = []
+        stack = [(node, 0, False)]
+        while len(stack) > 0:
+            node, depth, built = stack.pop()
+            if built:
+                term = node.term
+                if term.type == "lambda":
+                    scopes[term.arg].pop()
+                    body, loose = results.pop()
+                    key, loose = self.key_id(("lambda", term.arg if self.names else None, body)), max(loose - 1, 0)
+                else:
+                    right, right_loose = results.pop()
+                    left, left_loose = results.pop()
+                    key, loose = self.key_id(("call", left, right)), max(left_loose, right_loose)
+            else:
+                node = node.deref()
+                known = getattr(node, self.attribute)
+                if known is not None:
+                    results.append((known, 0))
+                    continue
+                term = node.term
+                if term.type == "var":
+                    if len(scopes.get(term.var, [])) > 0:
+                        index = depth - 1 - scopes[term.var][-1]
+                        results.append((self.key_id(("var", index)), index + 1))
+                        continue
+                    key, loose = self.key_id(("free", term.var)), 0
+                elif term.type == "lambda":
+                    scopes.setdefault(term.arg, []).append(depth)
+                    stack += [(node, depth, True), (term.body, depth + 1, False)]
+                    continue
+                elif term.type == "call":
+                    stack += [(node, depth, True), (term.right, depth, False), (term.left, depth, False)]
+                    continue
+                else:
+                    # Nothing holding a Tuple has a key
+                    return None
+            if loose == 0:
+                setattr(node, self.attribute, key)
+            results.append((key, loose))
+        return results[0][0]
+
+    # Returns the term with closed subterms shared, the nodes of term are reused
+    def intern(self, term):
+        scopes = {} # name -> depths of the binders with that name
+        # (node to use, key id, 1 + highest de Bruijn index pointing outside of the subterm) of the subterms done
+        results = []
+        stack = [(term, 0, False)]
+        while len(stack) > 0:
+            node, depth, built = stack.pop()
+            term = node.unwrap()
+            if built:
+                if term.type == "lambda":
+                    scopes[term.arg].pop()
+                    term.body, body, loose = results.pop()
+                    key, loose = self.key_id(("lambda", term.arg if self.names else None, body)), max(loose - 1, 0)
+                else:
+                    term.right, right, right_loose = results.pop()
+                    term.left, left, left_loose = results.pop()
+                    key, loose = self.key_id(("call", left, right)), max(left_loose, right_loose)
+            elif term.type == "var":
+                if len(scopes.get(term.var, [])) > 0:
+                    index = depth - 1 - scopes[term.var][-1]
+                    results.append((node, self.key_id(("var", index)), index + 1))
+                    continue
+                key, loose = self.key_id(("free", term.var)), 0
+            elif term.type == "lambda":
+                scopes.setdefault(term.arg, []).append(depth)
+                stack += [(node, depth, True), (term.body, depth + 1, False)]
+                continue
+            elif term.type == "call":
+                stack += [(node, depth, True), (term.right, depth, False), (term.left, depth, False)]
+                continue
+            if loose > 0:
+                results.append((node, key, loose))
+                continue
+            # Closed: the first node seen with this key is shared, unless it was reduced since
+            shared = self.nodes.get(key)
+            if shared is None or getattr(shared, self.attribute) != key:
+                setattr(node, self.attribute, key)
+                self.nodes[key] = node
+                shared = node
+            results.append((shared, key, 0))
+        return results[0][0]
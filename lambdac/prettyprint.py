@@ -11,14 +11,33 @@ def close_color():
     color_stack -= 1
     return colors[color_stack % len(colors)]
 
+# Walks the term with an explicit stack of what is left to write: terms, and text to add after a term,
+# as ("close", text) when it ends a parenthesized term (and its color)
 def _prettify(tree):
-    tree = tree.unwrap()
-    if tree.type == "call":
-        return open_color() + f"({_prettify(tree.left)} {_prettify(tree.right)})" + close_color()
-    if tree.type == "var":
-        return tree.var
-    if tree.type == "lambda":
-        return open_color() + f"[λ{tree.arg}.{_prettify(tree.body)}]" + close_color()
+    parts = []
+    stack = [tree]
+    while len(stack) > 0:
+        tree = stack.pop()
+        if isinstance(tree, tuple):
+            parts.append(tree[1] + close_color() if tree[0] == "close" else tree[1])
+            continue
+        tree = tree.unwrap()
+        if tree.type == "call":
+            parts.append(open_color() + "(")
+            stack += [("close", ")"), tree.right, ("text", " "), tree.left]
+        elif tree.type == "var":
+            parts.append(tree.var)
+        elif tree.type == "lambda":
+            parts.append(open_color() + f"[λ{tree.arg}.")
+            stack += [("close", "]"), tree.body]
+        elif tree.type == "tuple":
+            parts.append(open_color() + f"{tree.kind}<")
+            stack.append(("close", ">"))
+            for i, item in reversed(list(enumerate(tree.items[tree.start:]))):
+                stack.append(item)
+                if i > 0:
+                    stack.append(("text", ", "))
+    return "".join(parts)
 
 def pretty(tree) -> str:
     return _prettify(tree) + "\x1b[39m"
@@ -0,0 +1,126 @@
+import time
+
+from lambdac.parser import *
+import lambdac.stdlib as std
+import lambdac.delta as delta
+
+# Source level profile of a reduction: the steps (and the time) spent on each line of the Magma program and in
+# each stdlib combinator, like a flat profile
+# Nodes are tagged with (line, origin), see Node.tag: magma/to_lambda.py tags the code it builds for a statement
+# with its line and the stdlib function it comes from (state.for_loop, operator +...), the combinators themselves
+# being shared by the whole program only get their name (numbers.mod, array.setter...), from name_combinators
+# A step is charged to the origin of the function it applies, on the line of the application calling it (each
+# completed by the other if they do not know). The nodes built by the step inherit that tag where theirs says
+# nothing, so that the work done inside of a combinator is charged to the line it was called from
+# Each step is also charged the time since the previous one, finding its redex included
+class Profile:
+    def __init__(self):
+        self.steps = {} # tag -> steps
+        self.times = {} # tag -> seconds
+        self.last = None
+
+    def start(self):
+        self.last = time.perf_counter()
+
+    def charge(self, tag):
+        now = time.perf_counter()
+        self.steps[tag] = self.steps.get(tag, 0) + 1
+        self.times[tag] = self.times.get(tag, 0.0) + now - self.last
+        self.last = now
+
+    # (steps, time) for each key(tag)
+    def totals(self, key):
+        totals = {}
+        for tag, steps in self.steps.items():
+            k = key(tag)
+            s, t = totals.get(k, (0, 0.0))
+            totals[k] = (s + steps, t + self.times[tag])
+        return totals
+
+    # Table of the limit keys with the most steps, labelled by label(key)
+    def table(self, title, key, label, limit):
+        totals = self.totals(key)
+        steps = max(sum(s for s, _ in totals.values()), 1)
+        seconds = max(sum(t for _, t in totals.values()), 1e-9)
+        rows = [f"{'% steps':>8} {'steps':>10} {'% time':>8} {'seconds':>9}  {title}"]
+        for k, (s, t) in sorted(totals.items(), key=lambda item: item[1][0], reverse=True)[:limit]:
+            rows.append(f"{100 * s / steps:7.2f}% {s:>10} {100 * t / seconds:7.2f}% {t:>9.3f}  {label(k)}")
+        if len(totals) > limit:
+            rows.append(f"... {len(totals) - limit} more")
+        return "\n".join(rows)
+
+    # Flat profiles by line (quoting source, the lines of the program, if given) and by origin
+    def report(self, source=None, limit=20):
+        def line(n):
+            if n is None:
+                # Not in a statement: the initial state, the prelude, or a term without lines
+                return "?"
+            if source is None or n > len(source):
+                return f"line {n}"
+            return f"line {n}: {source[n - 1].strip()}"
+        by_line = self.table("line", lambda tag: tag[0], line, limit)
+        by_origin = self.table("origin", lambda tag: tag[1], lambda origin: origin or "?", limit)
+        return by_line + "\n\n" + by_origin
+
+# Tag a step contracting the redex in node is charged to: the line of node and the origin of its head, the function
+# applied to depth arguments
+def redex_tag(node, depth):
+    node = node.deref()
+    head = node
+    for _ in range(depth):
+        head = head.term.left.deref()
+    line, origin = node.tag or (None, None)
+    head_line, head_origin = head.tag or (None, None)
+    return (line if line is not None else head_line, head_origin if head_origin is not None else origin)
+
+# libraries -> {shape: (name, size)} of every closed combinator in the stdlib classes they use, named class.attribute
+names = {}
+
+def stdlib_names(libraries):
+    if libraries not in names:
+        shapes = {}
+        classes = [std.pair, std.flow, std.bools]
+        for lib in libraries:
+            classes += [lib.numbers, lib.memory, lib.array, lib.state]
+            if lib.memory.name == "tree":
+                classes.append(std.braun_tree)
+        for cls in classes:
+            for attr, value in vars(cls).items():
+                if attr.startswith("_") or not isinstance(value, str):
+                    continue
+                combinator = parse_lambda_term(Stream(lex(value)))
+                found = delta.shape(combinator)
+                # The first name wins for combinators defined twice
+                if found is not None and found not in shapes:
+                    shapes[found] = (f"{cls.__name__}.{attr}", delta.size(combinator, {}))
+        names[libraries] = shapes
+    return names[libraries]
+
+# Tags the untagged occurrences of stdlib combinators in the term with their name, recognized up to α-equivalence
+# as delta.mark does: terms read from a file get a profile by combinator, only compiled ones know their lines
+# lib is the stdlib the term was compiled with, if known, the names of all of them are tried otherwise
+def name_combinators(term, lib=None):
+    shapes = stdlib_names(tuple(std.libraries.values()) if lib is None else (lib,))
+    lengths = set(length for (_, length) in shapes.values())
+    sizes = {}
+    delta.size(term, sizes)
+    named = []
+    for node, length in sizes.values():
+        if length in lengths and node.tag is None:
+            found = shapes.get(delta.shape(node))
+            if found is not None:
+                named.append((length, node, found[0]))
+    # The subterms of a combinator are its own (the function it hands to flow.Y...), unless they are one of the
+    # smaller combinators it is made of, which are tagged first
+    for _, node, name in sorted(named, key=lambda item: item[0]):
+        stack = [node]
+        while len(stack) > 0:
+            node = stack.pop()
+            if node.tag is not None and node.tag[1] != name:
+                continue
+            node.tag = (None, name)
+            term = node.unwrap()
+            if term.type == "lambda":
+                stack.append(term.body)
+            elif term.type == "call":
+                stack += [term.left, term.right]
@@ -1,59 +1,172 @@
+import itertools
+
+from lambdac.parser import *
+from lambdac.prettyprint import pretty
+import lambdac.delta as delta
+import lambdac.profiler as profiler
+import lambdac.stdlib as std
+
 # Returns Free[term], Bound[term]
-def get_variables(term): # Empty set is not modified, this is fine
-    term = term.unwrap()
-    if term._type == "lambda":
-        return get_variables(term.body, bound | {term.arg})
-    if term._type == "call":
-        leftf, leftb = get_variables(term._left, bound)
-        rightf, rightb = get_variables(term._right, bound)
-        return leftf | rightf, leftb | rightb
-    if term._type == "var":
-        if term.var in bound:
-            return set(), bound
-        else:
-            return {term.var}, bound
+def get_variables(term, bound=set()): # Empty set is not modified, this is fine
+    free_vars, bound_vars = set(), set()
+    stack = [(term, bound)]
+    while len(stack) > 0:
+        term, bound = stack.pop()
+        term = term.unwrap()
+        if term._type == "lambda":
+            stack.append((term.body, bound | {term.arg}))
+        elif term._type == "call":
+            stack.append((term._right, bound))
+            stack.append((term._left, bound))
+        elif term._type == "var":
+            if term.var not in bound:
+                free_vars.add(term.var)
+            bound_vars |= bound
+    return free_vars, bound_vars
 
-def alpha_reduce(term):
-    term = term.unwrap()
-    if term.type == "var":
-        if term.var == x:
-            return arg
-        return Node(term)
-    
-    if term.type == "lambda":
-        if term.arg == x:
-            # Instances of x inside of this term are independant of outside x's, we do nothing
-            return Node(term)
-        
-        argfree, _ = get_variables(arg)
-        if term.arg in argfree:
-            # Generate fresh variable name
-            termfree, termbound = get_variables(term)
-            spoiled = argfree | termfree | termbound
-
-            i = 0
-            while f"v{i}" in spoiled:
-                i += 1
-
-            # Now v{i} is a fresh variable
-            body = alpha_reduce(term.body, term.arg, Variable(f"v{i}"))
-            return Node(Abstraction(f"v{i}", alpha_reduce(body, x, arg)))
-        else:
-            return Node(Abstraction(term.arg, alpha_reduce(term.body, x, arg)))
-    
-    if term.type == "call":
-        return Node(Application(alpha_reduce(term.left, x, arg), alpha_reduce(term.right, x, arg)))
+# Free variables of every closed term, and of each variable on its own, shared rather than made for each node
+NO_VARIABLES = frozenset()
+single_variables = {}
+
+# Free variables of the term in node, cached on the nodes along the way
+# Reduction can only remove free variables, so a cache outliving an in place update is at worst too large,
+# which only ever costs an unneeded renaming
+# Nodes stay on the stack until the free variables of all of their children are known
+def free_variables(node):
+    if node.free is not None:
+        return node.free
+    stack = [node]
+    while node.free is None:
+        top = stack[-1]
+        term = top.unwrap()
+        if term.type == "var":
+            children = ()
+        elif term.type == "lambda":
+            children = (term.body,)
+        elif term.type == "call":
+            children = (term.left, term.right)
+        elif term.type == "tuple":
+            children = term.items[term.start:]
+        unknown = [child for child in children if child.free is None]
+        if len(unknown) > 0:
+            stack += unknown
+            continue
+        stack.pop()
+        if top.free is not None:
+            # Shared node, reached twice
+            continue
+        if term.type == "var":
+            if term.var not in single_variables:
+                single_variables[term.var] = frozenset((term.var,))
+            free = single_variables[term.var]
+        elif term.type == "lambda":
+            free = term.body.free
+            if term.arg in free:
+                free = free - {term.arg} if len(free) > 1 else NO_VARIABLES
+        elif term.type == "call":
+            left = term.left.free
+            right = term.right.free
+            if right <= left:
+                free = left
+            elif left <= right:
+                free = right
+            else:
+                free = left | right
+        elif term.type == "tuple":
+            if term.free is None:
+                term.free = frozenset().union(*(item.free for item in children)) or NO_VARIABLES
+            free = term.free
+        top.free = free
+    return node.free
+
+fresh_counter = itertools.count()
+
+# Monotonic supply of variable names never used anywhere before
+def fresh_name():
+    counters.renames += 1
+    name = f"v{next(fresh_counter)}"
+    while name in names_in_use:
+        name = f"v{next(fresh_counter)}"
+    return name
+
+def alpha_reduce(term, x, arg, tag=None):
+    return substitute(term, {x: arg}, tag)
+
+# Holds one of the items of a tuple being substituted, the way the fields of the other terms hold their children
+class Slot:
+    __slots__ = ("term",)
+
+# term with every free variable in subst replaced by its value, binders capturing a free variable of one of
+# the values being renamed to a fresh variable as part of the same substitution
+# The copy is built top down with an explicit stack of (node, subst, parent, field), the result for node
+# going into the field of parent, so that the depth of the term does not matter
+# With a tag (when profiling), the nodes of the copy inherit it, see parser.inherited_tag
+def substitute(term, subst, tag=None):
+    root = Node(None)
+    stack = [(term, subst, root, "term")]
+    while len(stack) > 0:
+        node, subst, parent, field = stack.pop()
+        if type(node) is list:
+            # The slots of a tuple, below its items on the stack, all filled in by now
+            setattr(parent, field, tuple(slot.term for slot in node))
+            continue
+        term = node.unwrap()
+        if free_variables(node).isdisjoint(subst):
+            # Nothing to replace in there, the subterm stays shared with the original (and with the argument of an
+            # earlier step it may be), and so does the work done on it
+            setattr(parent, field, node)
+            continue
+        if node.delta is not None:
+            # Combinators marked for delta rules are closed, they are shared rather than copied to keep the mark
+            result = node
+        elif term.type == "var":
+            if term.var in subst:
+                # The argument stays as it is
+                setattr(parent, field, subst[term.var])
+                counters.substituted += 1
+                continue
+            else:
+                result = Node(term)
+        elif term.type == "lambda":
+            if term.arg in subst:
+                # Instances of term.arg inside of this term are independant of outside ones
+                subst = {v: value for (v, value) in subst.items() if v != term.arg}
+            if len(subst) == 0:
+                result = Node(term)
+            else:
+                arg = term.arg
+                if any(arg in free_variables(value) for value in subst.values()):
+                    # Rename the binder to a fresh variable
+                    arg = fresh_name()
+                    subst = dict(subst)
+                    subst[term.arg] = Node(Variable(arg))
+                result = Node(Abstraction(arg, None))
+                stack.append((term.body, subst, result.term, "body"))
+        elif term.type == "call":
+            result = Node(Application(None, None))
+            # Left first, fresh names are given in the same order as by a recursive substitution
+            stack.append((term.right, subst, result.term, "right"))
+            stack.append((term.left, subst, result.term, "left"))
+        elif term.type == "tuple":
+            result = Node(Tuple(term.kind, None))
+            slots = [Slot() for _ in term.items[term.start:]]
+            stack.append((slots, subst, result.term, "items"))
+            stack += reversed([(item, subst, slot, "term") for (item, slot) in zip(term.items[term.start:], slots)])
+        if tag is not None and result is not node:
+            result.tag = inherited_tag(node.deref().tag, tag)
+        setattr(parent, field, result)
+    return root.term
 
 def is_beta_reducible(term):
     # Checks if term is of the form (λx.f[x]) y
     term = term.unwrap()
     return term.type == "call" and term._left.type == "lambda"
 
-def beta_reduce(term):
+def beta_reduce(term, tag=None):
     # Perform a beta-reduction to the contents of the Node, at the root
     # (λx.f[x]) y -> f[x/y]
     term = term.unwrap()
-    return alpha_reduce(term._left.body, term._left.arg, term.right)
+    return alpha_reduce(term._left.body, term._left.arg, term.right, tag)
 
 def perform_reduction(term):
     # Breadth first search (left to right) until beta or eta reducible expression is found
@@ -63,7 +176,7 @@ def perform_reduction(term):
     while len(queue) > 0:
         item = queue.popleft()
         if is_beta_reducible(item):
-            item.term = beta_reduce(item)
+            item.update(beta_reduce(item))
             return True
         
         if item._type == "lambda":
@@ -73,6 +186,304 @@ def perform_reduction(term):
             queue.append(item.unwrap().right)
     return False
 
+# The booleans, parsed once: closed and in normal form, the expansions share them as define_primitives shares the
+# definitions of the primitives
+TRUE = parse_lambda_term(Stream(lex(std.true)))
+FALSE = parse_lambda_term(Stream(lex(std.false)))
+
+# One level of the chain of pairs the Tuple in node stands for, the rest of it staying a Tuple
+# The pairs themselves are new nodes every time: a delta rule may update one into a Tuple (see delta_argument)
+def expand_tuple(node):
+    t = node.unwrap()
+    if t.start == len(t.items):
+        if t.kind == "list":
+            return Node(Variable(std.arbitrary_value))
+        # Empty array: λb.b false nil
+        return Node(Abstraction("b", Node(Application(Node(Application(Node(Variable("b")), FALSE)),
+                                                      Node(Variable(std.arbitrary_value))))))
+    rest = Node(Tuple(t.kind, t.items, t.start + 1, t.free))
+    b = fresh_name() if "b" in free_variables(node) else "b"
+    cell = Node(Abstraction(b, Node(Application(Node(Application(Node(Variable(b)), t.items[t.start])), rest))))
+    if t.kind == "list":
+        return cell
+    return Node(Abstraction(b, Node(Application(Node(Application(Node(Variable(b)), TRUE)), cell))))
+
+FLAGS = {delta.shape(TRUE): True, delta.shape(FALSE): False}
+
+# (first, rest) if term is the pair λb.b first rest, None otherwise
+def unpair(term):
+    if term.type != "lambda":
+        return None
+    body = term.body.unwrap()
+    if body.type != "call" or body._left.type != "call":
+        return None
+    function = body._left._left
+    first, rest = body._left.right, body.right
+    if function.type != "var" or function.var != term.arg:
+        return None
+    if term.arg in free_variables(first) or term.arg in free_variables(rest):
+        return None
+    return first, rest
+
+# Tuple of the items of the chain of pairs in node, None if it is not one
+# Chains may end with a Tuple, left by an earlier expansion
+def tuple_of(node, kind):
+    items = []
+    term = node.unwrap()
+    while True:
+        if term.type == "tuple":
+            if term.kind != kind:
+                return None
+            if len(items) == 0:
+                return term
+            return Tuple(kind, tuple(items) + term.items[term.start:])
+        if kind == "list" and term.type == "var" and term.var == std.arbitrary_value:
+            return Tuple(kind, tuple(items))
+        cell = unpair(term)
+        if cell is None:
+            return None
+        if kind == "array":
+            # Arrays are pairs of a flag (not empty) and of a pair of the head and the tail
+            flag = FLAGS.get(delta.shape(cell[0]))
+            if flag is None:
+                return None
+            if not flag:
+                return Tuple(kind, tuple(items))
+            cell = unpair(cell[1].unwrap())
+            if cell is None:
+                return None
+        items.append(cell[0])
+        term = cell[1].unwrap()
+
+# Reference engine, searching the whole tree from the root at every step
+class BFSReducer:
+    unit = "steps"
+    delta_rules = False
+    primitives = False
+    memo = False
+    telemetry = True
+    profiling = False
+    checkpoints = True
+    budgets = True
+
+    def __init__(self, term, stats=None):
+        self.term = term
+        self.stats = stats
+
+    def step(self):
+        if self.stats is None:
+            return perform_reduction(self.term)
+        # Finding the redex and contracting it are not apart here, the whole step counts as contracting
+        reduced = self.stats.timed(perform_reduction, self.term)
+        if reduced:
+            self.stats.betas += 1
+        return reduced
+
+# Normal order (leftmost-outermost) reducer which remembers where it stopped
+# The path from the root to the current node is kept between steps, so finding the next redex
+# only looks at what the last contraction produced instead of searching the whole tree again
+class SpineReducer:
+    unit = "steps"
+    delta_rules = True
+    primitives = True
+    memo = True
+    telemetry = True
+    profiling = True
+    checkpoints = True
+    budgets = True
+
+    def __init__(self, term, until_tuple=False, cache=None, stats=None, profile=None):
+        self.term = term
+        self.focus = term.deref()
+        # Ancestors of focus, as (node, side) where side is the child of node we went into
+        self.path = []
+        # Reducer normalizing an argument of a delta rule before it can be applied
+        self.pending = None
+        # Stop as soon as the term is a Tuple, for arguments of delta rules taking data structures
+        self.until_tuple = until_tuple
+        # NormalFormCache of lambdac/memo.py, and the closed subterms being normalized that it does not know,
+        # as (depth in path, node, key), stored in it once the reducer climbs out of them
+        self.cache = cache
+        self.watch = []
+        # ReductionStats of lambdac/stats.py told about every contraction, and the time it took
+        self.stats = stats
+        # Profile of lambdac/profiler.py each step is charged to, the tags of its redex being carried into the contractum
+        self.profile = profile
+
+    def contract(self, node, tag=None):
+        node.update(beta_reduce(node, tag))
+
+    def delta_argument(self, arg, kind):
+        if kind == "number":
+            return delta.numeral_value(arg)
+        if kind == "term":
+            return arg
+        t = tuple_of(arg, kind)
+        node = arg.deref()
+        if t is not None and node.term is not t:
+            # Made out of a chain of pairs, kept as a Tuple for the next rules using it
+            node.update(t)
+            node.normal = False
+        return t
+
+    def contract_delta(self, node):
+        # Applies the delta rule if node is a marked combinator or primitive applied to values it can compute with,
+        # returns True if a step was done, or if an argument has to be normalized first
+        # Those arguments are given to self.pending, which takes the next steps (see step), each of them counting as
+        # a step of ours, and the rule is tried again once it is done
+        found = delta.match(node)
+        if found is None:
+            return False
+        rule, args = found
+        values = []
+        for arg, kind in zip(args, delta.argument_kinds(rule)):
+            value = self.delta_argument(arg, kind)
+            if value is None and not arg.deref().normal:
+                self.pending = type(self)(arg, kind in ("array", "list"), self.cache, self.stats, self.profile)
+                return True
+            if value is None:
+                return False
+            values.append(value)
+        tag = None if self.profile is None else profiler.redex_tag(node, len(values))
+        if self.stats is None:
+            result = delta.contract(rule, values)
+        else:
+            result = self.stats.timed(delta.contract, rule, values)
+        if result is None:
+            return False
+        node.update(result)
+        if self.stats is not None:
+            self.stats.deltas += 1
+        if tag is not None:
+            self.profile.charge(tag)
+        return True
+
+    def memoize(self, node):
+        # Replaces node by the normal form of the same closed application if the cache knows it,
+        # returns True if it did
+        if self.cache is None or node._type != "call" or node.delta is not None or len(free_variables(node)) > 0:
+            return False
+        # Only looked up as it is reached, not again after every step reducing it
+        depth = len(self.path)
+        if len(self.watch) > 0 and self.watch[-1][0] == depth:
+            return False
+        key = self.cache.key(node)
+        if key is None:
+            return False
+        found = self.cache.get(key)
+        if found is None:
+            self.watch.append((depth, node, key))
+            return False
+        node.update(found)
+        return True
+
+    def finish(self, depth):
+        # The watched subterms at least depth deep are in normal form, or reduced to a function being applied
+        while len(self.watch) > 0 and self.watch[-1][0] >= depth:
+            _, node, key = self.watch.pop()
+            self.cache.store(key, node.deref())
+
+    def next_focus(self, node):
+        node = node.deref()
+        # Only the parent can become a redex: everything else before node in normal order is untouched
+        if len(self.path) > 0 and self.path[-1][1] == "left" and node._type == "lambda":
+            node = self.path.pop()[0]
+            # What was watched in there is the closed application node now stands for, about to be applied: not its
+            # normal form yet, but a reduct of it with the same one, which a hit is reduced on from like any other term
+            self.finish(len(self.path) + 1)
+        return node
+
+    def step(self):
+        # Reduce the next redex in place and return True, or False if the term is in normal form
+        # Reducers of arguments of delta rules nest as deep as the rules wait on each other, the step is taken by the
+        # innermost one: they are gone through in a loop instead of each calling the next
+        chain = [self]
+        while chain[-1].pending is not None:
+            chain.append(chain[-1].pending)
+        while True:
+            reduced = chain[-1].advance()
+            if reduced is None:
+                chain.append(chain[-1].pending)
+            elif reduced or len(chain) == 1:
+                return reduced
+            else:
+                # Argument normalized, back to the rule waiting on it
+                chain.pop()
+                chain[-1].pending = None
+
+    def advance(self):
+        # step for this reducer alone, None if it gave the step to a new pending reducer instead
+        if self.until_tuple and self.term._type == "tuple":
+            return False
+        node = self.focus
+        while node is not None:
+            if node.normal:
+                node = self.climb()
+            elif self.memoize(node):
+                # Not a step: the normal form is taken as it is, and looked at from its parent on
+                node = self.next_focus(node)
+            elif self.contract_delta(node):
+                if self.pending is not None:
+                    # Stay on node while one of its arguments is being normalized
+                    self.focus = node
+                    return None
+                self.focus = self.next_focus(node)
+                return True
+            elif is_beta_reducible(node):
+                tag = None if self.profile is None else profiler.redex_tag(node, 1)
+                if self.stats is None:
+                    self.contract(node, tag)
+                else:
+                    self.stats.timed(self.contract, node, tag)
+                    self.stats.betas += 1
+                if tag is not None:
+                    self.profile.charge(tag)
+                self.focus = self.next_focus(node)
+                return True
+            else:
+                term = node.unwrap()
+                if term.type == "lambda":
+                    self.path.append((node, "body"))
+                    node = term.body.deref()
+                elif term.type == "call":
+                    self.path.append((node, "left"))
+                    node = term.left.deref()
+                elif term.type == "tuple":
+                    # Looked at as pairs: one level is expanded, in the parent only so that the Tuple stays for
+                    # everything else using it
+                    expanded = expand_tuple(node)
+                    if len(self.path) > 0:
+                        parent, side = self.path[-1]
+                        setattr(parent.unwrap(), side, expanded)
+                    else:
+                        node.update(expanded)
+                    self.focus = self.next_focus(expanded)
+                    if self.stats is not None:
+                        self.stats.expansions += 1
+                    if self.profile is not None:
+                        self.profile.charge(inherited_tag(node.tag, (None, "tuple expansion")))
+                    return True
+                else:
+                    node = self.climb()
+        self.focus = None
+        # Climbing out never marks a lone variable
+        self.term.deref().normal = True
+        self.finish(0)
+        return False
+
+    def climb(self):
+        # Leave a subterm in normal form, moving on to the next right hand side left to explore
+        while len(self.path) > 0:
+            parent, side = self.path.pop()
+            if side == "left":
+                self.finish(len(self.path) + 1)
+                self.path.append((parent, "right"))
+                return parent.unwrap().right.deref()
+            # Shared subterms are skipped the next time they are reached from somewhere else
+            parent.normal = True
+            self.finish(len(self.path))
+        return None
+
 def render_state_printer(state_tree):
     printer = state_tree.unwrap().body.unwrap().right.unwrap()
     contents = []
@@ -85,4 +496,6 @@ def render_state_printer(state_tree):
             raise
         printer = nprinter
     for i in contents[::-1]:
-        print("P>", pretty(i))
\ No newline at end of file
+        # Numbers of programs compiled with --binary are shown as the integer they encode
+        value = delta.binary_value(i)
+        print("P>", pretty(i) if value is None else value)
\ No newline at end of file
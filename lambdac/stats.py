@@ -0,0 +1,133 @@
+import json
+import time
+
+from lambdac.parser import *
+
+# Telemetry of a reduction: steps by kind (β, delta rules, expansions of Tuples), variable occurrences substituted,
+# binders α-renamed and nodes allocated, the time spent contracting redexes against the time spent finding them,
+# and a timeline of samples of the size and depth of the term
+# Counting costs next to nothing, and reading the clock little: only one contraction in every period is timed,
+# contract_time adding up period times what it took, and the loop running the engine only reports its progress
+# every so often (every 64 steps in run.py)
+# Measuring the term walks all of it, samples are spaced so that taking them stays under overhead of the running
+# time, and at least interval seconds apart
+# callback, if given, is called with each sample as it is taken (as the dict added to the timeline)
+# Engines without telemetry (see their class attribute) only get steps, time and counters
+class ReductionStats:
+    def __init__(self, callback=None, interval=0.25, overhead=0.01, period=16):
+        self.callback = callback
+        self.interval = interval
+        self.overhead = overhead
+        self.period = period
+        self.steps = 0
+        # Counted by the engine: β-steps, delta rules applied, Tuples expanded into pairs
+        self.betas = 0
+        self.deltas = 0
+        self.expansions = 0
+        self.contractions = 0
+        self.contract_time = 0.0
+        self.sample_time = 0.0
+        self.timeline = []
+        self.engine = None
+
+    # contract(*args), run by the engine for each contraction
+    def timed(self, contract, *args):
+        self.contractions += 1
+        if self.contractions % self.period != 0:
+            return contract(*args)
+        t0 = time.perf_counter()
+        result = contract(*args)
+        self.contract_time += self.period * (time.perf_counter() - t0)
+        return result
+
+    def start(self, engine):
+        self.engine = engine
+        self.base = self.counted()
+        self.started = time.perf_counter()
+        self.next_sample = self.started
+        self.sample()
+
+    # Number of steps the engine did so far, samples are taken from here once it is time to
+    def progress(self, steps):
+        self.steps = steps
+        if time.perf_counter() >= self.next_sample:
+            self.sample()
+
+    def finish(self, steps):
+        self.finished = time.perf_counter()
+        self.steps = steps
+        self.sample()
+        # Printing the result allocates nodes as well
+        self.final = self.totals()
+
+    def counted(self):
+        return counters.total()
+
+    def totals(self):
+        nodes, renames, substituted = [now - base for now, base in zip(self.counted(), self.base)]
+        return {"nodes_allocated": nodes, "renames": renames, "substitutions": substituted}
+
+    def sample(self):
+        t0 = time.perf_counter()
+        size, depth = measure(self.engine.term) if self.engine.telemetry else (None, None)
+        sample = {"step": self.steps, "time": t0 - self.started - self.sample_time, "size": size, "depth": depth}
+        sample.update(self.totals())
+        self.timeline.append(sample)
+        if self.callback is not None:
+            self.callback(sample)
+        t1 = time.perf_counter()
+        self.sample_time += t1 - t0
+        self.next_sample = t1 + max(self.interval, (t1 - t0) / self.overhead)
+
+    def report(self):
+        # Time the engine ran, without the samples
+        total = self.finished - self.started - self.sample_time
+        telemetry = self.engine.telemetry
+        report = {
+            "engine": type(self.engine).__name__,
+            "unit": self.engine.unit,
+            # Engines which do not reduce one step at a time count their own work
+            "steps": getattr(self.engine, "steps", self.steps),
+            "beta_steps": self.betas if telemetry else None,
+            "delta_steps": self.deltas if telemetry else None,
+            "tuple_expansions": self.expansions if telemetry else None,
+        }
+        report.update(self.final)
+        report.update({
+            "time": total,
+            "contract_time": self.contract_time if telemetry else None,
+            "find_time": total - self.contract_time if telemetry else None,
+            "sample_time": self.sample_time,
+            "timeline": self.timeline,
+        })
+        return report
+
+    def write(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=1)
+
+# Number of distinct nodes in the term (shared ones counted once) and its depth, with an explicit stack
+def measure(term):
+    depths = {} # id(node) -> depth of the subterm in it
+    stack = [term.deref()]
+    while len(stack) > 0:
+        node = stack[-1]
+        if id(node) in depths:
+            stack.pop()
+            continue
+        t = node.term
+        if t.type == "lambda":
+            children = (t.body.deref(),)
+        elif t.type == "call":
+            children = (t.left.deref(), t.right.deref())
+        elif t.type == "tuple":
+            children = tuple(item.deref() for item in t.items[t.start:])
+        else:
+            children = ()
+        unknown = [child for child in children if id(child) not in depths]
+        if len(unknown) > 0:
+            stack += unknown
+            continue
+        depths[id(node)] = 1 + max((depths[id(child)] for child in children), default=0)
+        stack.pop()
+    return len(depths), depths[id(term.deref())]
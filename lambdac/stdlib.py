@@ -28,6 +28,18 @@ class numbers:
     def make(n):
         return f"(λf.λa.{'(f ' * n}a{')'*n})"
 
+    # Term applying a function n times, a numeral does so itself
+    def iterate(n):
+        return n
+
+    # n ** m
+    def power(n, m):
+        return f"({m} {n})"
+
+    # n + 1 as a binary number, the path to index n in a braun_tree
+    def binary_successor(n):
+        return f"({n} {binary_numbers.succ} {binary_numbers.make(1)})"
+
     iszero = f"(λn.n(λa.{false}){true})" # n == 0?
     succ = f"(λn.λf.λa.f(n f a))" # n + 1
     pred = "(λn.λf.λx.n (λg.λh.h (g f)) (λu.x) (λu.u))" # n - 1
@@ -39,95 +51,335 @@ class numbers:
     ge = f"(λn.λm.({bools.notgate} ({iszero} ({sub} n m))))" # n > m iff n - m > 0 iff n - m != 0
     le = f"(λn.λm.({bools.notgate} ({iszero} ({sub} m n))))" # n < m
     eq = f"(λn.λm.{bools.andgate} ({leq} n m) ({leq} m n))" # m == n iff n <= m and n >= m
-    div = f"({flow.Y} λF.λn.λm.({le} n m)({make(0)})(F ({sub} n m) m))" # n / m
+    div = f"({flow.Y} λF.λn.λm.({le} n m)({make(0)})({succ} (F ({sub} n m) m)))" # n / m
     mod = f"({flow.Y} λF.λn.λm.({le} n m) n (F ({sub} n m) m))" # n % m
 
     fact = f"({flow.Y} (λF.λn.({iszero} n) ({make(1)}) (λf.n (F ({pred} n) f))))"
 
+# Numbers as lists of bits, least significant first, in the Scott encoding: λz.λo.λe. applied to what the number
+# starts with, z rest for a 0 bit, o rest for a 1 bit or e once there are no bits left
+# Numbers never end with a 0 bit (0 is only ever e), so the size of n and the cost of arithmetic on it are
+# logarithmic in n
+class binary_numbers:
+    end = "(λz.λo.λe.e)"
 
-class linked_list:
-    def make(size):
-        if size == 0:
-            return arbitrary_value
-        return pair.make(arbitrary_value, linked_list.make(size-1))
-    
-    # Args: list num
-    getter = f"(λl.λn.((n (λp.p {false}) l) ({true})))"
+    def bit0(rest):
+        return f"(λz.λo.λe.z ({rest}))" # 2 rest
+
+    def bit1(rest):
+        return f"(λz.λo.λe.o ({rest}))" # 2 rest + 1
+
+    def make(n):
+        bits = []
+        while n > 0:
+            bits.append("o" if n % 2 == 1 else "z")
+            n //= 2
+        return "".join(f"(λz.λo.λe.{b} " for b in bits) + binary_numbers.end + ")" * len(bits)
+
+    double = f"(λr.r (λx.{bit0('r')}) (λx.{bit0('r')}) {end})" # 2 r, without a trailing 0 bit when r is 0
+    iszero = f"(λn.n (λr.{false}) (λr.{false}) {true})"
+    succ = f"({flow.Y} (λS.λn.n (λr.{bit1('r')}) (λr.{bit0('S r')}) {bit1(end)}))" # n + 1
+    pred = f"({flow.Y} (λP.λn.n (λr.{bit1('P r')}) (λr.{double} r) {end}))" # n - 1, 0 for 0
+
+    # Args: carry n m, computes n + m + carry
+    add_carry = (f"({flow.Y} (λA.λc.λn.λm.n "
+        f"(λa.m (λb.c {bit1(f'A {false} a b')} ({double} (A {false} a b))) (λb.c {bit0(f'A {true} a b')} {bit1(f'A {false} a b')}) (c ({succ} n) n)) "
+        f"(λa.m (λb.c {bit0(f'A {true} a b')} {bit1(f'A {false} a b')}) (λb.c {bit1(f'A {true} a b')} {bit0(f'A {true} a b')}) (c ({succ} n) n)) "
+        f"(c ({succ} m) m)))")
+    add = f"(λn.λm.{add_carry} {false} n m)" # n + m
+
+    # Args: borrow n m, computes n - m - borrow when it is not negative
+    sub_borrow = (f"({flow.Y} (λS.λw.λn.λm.n "
+        f"(λa.m (λb.w {bit1(f'S {true} a b')} ({double} (S {false} a b))) (λb.w ({double} (S {true} a b)) {bit1(f'S {true} a b')}) (w ({pred} n) n)) "
+        f"(λa.m (λb.w ({double} (S {false} a b)) {bit1(f'S {false} a b')}) (λb.w {bit1(f'S {true} a b')} ({double} (S {false} a b))) (w ({pred} n) n)) "
+        f"{end}))")
+
+    # Args: s n m, compares bits from the lowest, s being the result if all higher bits are equal
+    # Gives n <= m with s = true and n < m with s = false
+    compare = (f"({flow.Y} (λL.λs.λn.λm.n "
+        f"(λa.m (λb.L s a b) (λb.L {true} a b) {false}) "
+        f"(λa.m (λb.L {false} a b) (λb.L s a b) {false}) "
+        f"(m (λb.{true}) (λb.{true}) s)))")
+    leq = f"(λn.λm.{compare} {true} n m)" # n <= m
+    geq = f"(λn.λm.{compare} {true} m n)" # n >= m
+    le = f"(λn.λm.{compare} {false} n m)" # n < m
+    ge = f"(λn.λm.{compare} {false} m n)" # n > m
+    eq = f"({flow.Y} (λQ.λn.λm.n (λa.m (λb.Q a b) (λb.{false}) {false}) (λa.m (λb.{false}) (λb.Q a b) {false}) (m (λb.{false}) (λb.{false}) {true})))"
+
+    sub = f"(λn.λm.({leq} n m) {end} ({sub_borrow} {false} n m))" # n - m, 0 if m >= n
+    mult = f"({flow.Y} (λM.λn.λm.n (λa.{double} (M a m)) (λa.{add} m ({double} (M a m))) {end}))" # n * m
+
+    # Long division, from the highest bit of n: (quotient, remainder) of n by m
+    # x is the remainder of the higher bits with the next bit of n added, m goes into it at most once
+    divide_step = f"(λm.λp.λx.({geq} x m) {pair.make(bit1(f'p {true}'), f'{sub_borrow} {false} x m')} {pair.make(f'{double} (p {true})', 'x')})"
+    divmod = (f"({flow.Y} (λD.λn.λm.n "
+        f"(λa.(λp.{divide_step} m p ({double} (p {false}))) (D a m)) "
+        f"(λa.(λp.{divide_step} m p {bit1(f'p {false}')}) (D a m)) "
+        f"{pair.make(end, end)}))")
+    # Dividing by 0 gives a quotient of all 1 bits instead of never terminating
+    div = f"(λn.λm.{divmod} n m {true})" # n / m
+    mod = f"(λn.λm.{divmod} n m {false})" # n % m
+
+    pow = f"({flow.Y} (λP.λn.λk.k (λr.(λh.{mult} h h) (P n r)) (λr.(λh.{mult} n ({mult} h h)) (P n r)) {bit1(end)}))" # n ** k
+    fact = f"({flow.Y} (λF.λn.({iszero} n) {bit1(end)} ({mult} n (F ({pred} n)))))"
 
-    # Args: list num newval
-    setter = f"({flow.Y} (λF.λl.λn.λx.({numbers.iszero} n) (λp.p(x)({pair.second} l)) (λp.p({pair.first} l)(F ({pair.second} l) ({numbers.pred} n) x))))"
+    # Args: n f x, f applied n times to x
+    repeat = f"({flow.Y} (λT.λn.λf.λx.n (λr.T r f (T r f x)) (λr.f (T r f (T r f x))) x))"
 
+    def iterate(n):
+        return f"({binary_numbers.repeat} {n})"
+
+    def power(n, m):
+        return f"({binary_numbers.pow} {n} {m})"
+
+    def binary_successor(n):
+        return f"({binary_numbers.succ} {n})"
+
+# Built from the end, the last cell first
 def make_array(contents):
-    if len(contents) == 0:
-        return pair.make(false, arbitrary_value)
-    return pair.make(true, pair.make(contents[0], make_array(contents[1:])))
+    result = pair.make(false, arbitrary_value)
+    for item in reversed(contents):
+        result = pair.make(true, pair.make(item, result))
+    return result
 
-class array:
-    # Data type for usage by the program
-    make = make_array
+# Braun tree: the item at index 0 with the items at odd indices in its left subtree, those at even indices (but 0)
+# in its right subtree, each subtree holding half of the rest, so that it is never deeper than log2 of its size
+# Items are found by a path, index + 1 as a binary number: its bits after the highest one, lowest first, pick the
+# left subtree for a 0 and the right one for a 1, the item is at the node where they run out
+# Node: λn.λe.n item left right, empty tree: λn.λe.e
+class braun_tree:
+    empty = "(λn.λe.e)"
 
-    # New list [e, ...lst]
-    def prepend(e, lst):
-        return pair.make(true, pair.make(e, lst))
-    
-    head = f"(λl.{pair.first} ({pair.second} l))"
-    tail = f"(λl.{pair.second} ({pair.second} l))"
+    def node(item, left, right):
+        return f"(λn.λe.n ({item}) ({left}) ({right}))"
 
-    # Args: arr id
-    getter = f"(λl.λn.(n (λp.p {false} {false}) l) {false} {true})"
+    def make(contents):
+        if len(contents) == 0:
+            return braun_tree.empty
+        return braun_tree.node(contents[0], braun_tree.make(contents[1::2]), braun_tree.make(contents[2::2]))
 
-    # Args: arr id val
-    setter = f"({flow.Y} (λF.λl.λn.λx.({numbers.iszero} n) (λb.b({true})(λp.p(x)({tail} l))) (λb.b({true})(λp.p({head} l)(F ({tail} l) ({numbers.pred} n) x)))))"
+    # Path to index n known when compiling
+    def path(n):
+        return binary_numbers.make(n + 1)
 
-    # Args: arr (g := λacc.λx.acc') acc
-    fold_left = f"({flow.Y} (λF.λl.λg.λa.({pair.first} l) (F ({tail} l) g (g a ({head} l))) a))"
+    # Args: tree path
+    getter = f"({flow.Y} (λG.λt.λk.t (λx.λl.λr.k (λp.G l p) (λp.({binary_numbers.iszero} p) x (G r p)) x) {arbitrary_value}))"
 
-    # range n m gives [n, n+1, ..., m]
-    range = f"({flow.Y} (λF.λn.λm.({numbers.eq} n m)({make(['m'])})(" + prepend('n', f"(F ({numbers.succ} n) m)") + ")))"
+    # Args: tree path newval
+    setter = (f"({flow.Y} (λS.λt.λk.λv.t (λx.λl.λr.k "
+        f"(λp.{node('x', 'S l p v', 'r')}) "
+        f"(λp.({binary_numbers.iszero} p) {node('v', 'l', 'r')} {node('x', 'l', 'S r p v')}) t) t))")
 
-class state:
-    def make(memsize):
-        # <Memory, Print>
-        return f"(λi.i({linked_list.make(memsize)})({linked_list.make(0)}))"
+    nonempty = f"(λt.t (λx.λl.λr.{true}) {false})"
+    head = f"(λt.t (λx.λl.λr.x) {arbitrary_value})"
 
-    # Helper functions
-    get_mem = f"(st {true})"
-    get_prnt = f"(st {false})"
+    # Args: left right of a node, the tree of its items without the first one
+    merge = f"({flow.Y} (λM.λa.λb.a (λx.λl.λr.{node('x', 'b', 'M l r')}) {empty}))"
+    tail = f"(λt.t (λx.λl.λr.{merge} l r) {empty})"
 
-    set_mem =  f"(λm.λi.i m {get_prnt})"
-    set_prnt = f"(λm.λi.i {get_mem} m)"
+    # Args: item tree, the tree with item added at index 0
+    cons = f"({flow.Y} (λC.λv.λt.t (λx.λl.λr.{node('v', 'C x r', 'l')}) {node('v', empty, empty)}))"
 
-    # Provide variable id as arg
-    get_variable = f"({linked_list.getter} {get_mem})"
+# Data structures and the program state, on the numerals of numbers
+# With trees, arrays and the memory of the program are Braun trees rather than lists, read and written in a
+# number of steps logarithmic in their size instead of linear
+def data_structures(numbers, trees=False):
+    class linked_list:
+        name = "list"
 
-    # State pipeline functions
-    def variable_setter(varid, value):
-        if isinstance(varid, int):
-            varid = numbers.make(varid)
-        return f"(λst.{state.set_mem} ({linked_list.setter} {state.get_mem} ({varid}) ({value})))"
+        def make(size):
+            result = arbitrary_value
+            for _ in range(size):
+                result = pair.make(arbitrary_value, result)
+            return result
 
-    def array_setter(varid, ind, value):
-        if isinstance(varid, int):
-            varid = numbers.make(varid)
-        return state.variable_setter(varid, f"{array.setter} ({state.get_mem} ({varid})) {ind} {value}")
+        # Index n known when compiling
+        def key(n):
+            return numbers.make(n)
 
-    def printer(value):
-        return f"(λst.{state.set_prnt} (λp.p({value}){state.get_prnt}))"
-    
-    def repeater(value, body):
-        return f"({value} ({body}))"
-    
-    # Doubt
-    def for_loop(varid, iterable, body):
-        if isinstance(varid, int):
-            varid = numbers.make(varid)
-        # arr (g := λst.λx.st') st
-        var_setter = f"{state.set_mem} ({linked_list.setter} {state.get_mem} {varid} x)"
-        var_setter = state.variable_setter(varid, f"{array.head} l")
-        return f"(λst.{flow.Y} (λF.λl.λst.({pair.first} l) (F ({array.tail} l) ({body} ({var_setter} st))) st) ({iterable}) st)"
-    
-    def while_loop(expr, body):
-        return f"({flow.Y} (λF.λst.({expr}) (F ({body} st)) st) )"
-    
-    def if_statement(expr, true_block, false_block):
-        return f"(λst.{expr} ({true_block} st) ({false_block} st))"
\ No newline at end of file
+        # Args: list num
+        getter = f"(λl.λn.(({numbers.iterate('n')} (λp.p {false}) l) ({true})))"
+
+        # Args: list num newval
+        setter = f"({flow.Y} (λF.λl.λn.λx.({numbers.iszero} n) (λp.p(x)({pair.second} l)) (λp.p({pair.first} l)(F ({pair.second} l) ({numbers.pred} n) x))))"
+
+    # The variables of the program, each at the path to its id
+    class variable_tree:
+        name = "tree"
+
+        def make(size):
+            return braun_tree.make([arbitrary_value] * size)
+
+        key = braun_tree.path
+        getter = braun_tree.getter
+        setter = braun_tree.setter
+
+    memory = variable_tree if trees else linked_list
+
+    class array:
+        if trees:
+            make = braun_tree.make
+
+            # New tree [e, ...lst]
+            def prepend(e, lst):
+                return f"({braun_tree.cons} {e} {lst})"
+
+            nonempty = braun_tree.nonempty
+            head = braun_tree.head
+            tail = braun_tree.tail
+
+            # Args: arr id
+            getter = f"(λl.λn.{braun_tree.getter} l {numbers.binary_successor('n')})"
+
+            # Args: arr id val
+            setter = f"(λl.λn.{braun_tree.setter} l {numbers.binary_successor('n')})"
+        else:
+            # Data type for usage by the program
+            make = make_array
+
+            # New list [e, ...lst]
+            def prepend(e, lst):
+                return pair.make(true, pair.make(e, lst))
+
+            nonempty = pair.first
+            head = f"(λl.{pair.first} ({pair.second} l))"
+            tail = f"(λl.{pair.second} ({pair.second} l))"
+
+            # Args: arr id
+            getter = f"(λl.λn.({numbers.iterate('n')} (λp.p {false} {false}) l) {false} {true})"
+
+            # Args: arr id val
+            setter = f"({flow.Y} (λF.λl.λn.λx.({numbers.iszero} n) (λb.b({true})(λp.p(x)({tail} l))) (λb.b({true})(λp.p({head} l)(F ({tail} l) ({numbers.pred} n) x)))))"
+
+        # Args: arr (g := λacc.λx.acc') acc
+        fold_left = f"({flow.Y} (λF.λl.λg.λa.({nonempty} l) (F ({tail} l) g (g a ({head} l))) a))"
+
+        # range n m gives [n, n+1, ..., m]
+        range = f"({flow.Y} (λF.λn.λm.({numbers.eq} n m)({make(['m'])})(" + prepend('n', f"(F ({numbers.succ} n) m)") + ")))"
+
+    class state:
+        def make(memsize):
+            # <Memory, Print>
+            return f"(λi.i({memory.make(memsize)})({linked_list.make(0)}))"
+
+        # Helper functions
+        get_mem = f"(st {true})"
+        get_prnt = f"(st {false})"
+
+        set_mem =  f"(λm.λi.i m {get_prnt})"
+        set_prnt = f"(λm.λi.i {get_mem} m)"
+
+        # Provide variable id as arg
+        get_variable = f"({memory.getter} {get_mem})"
+
+        # State pipeline functions
+        def variable_setter(varid, value):
+            if isinstance(varid, int):
+                varid = memory.key(varid)
+            return f"(λst.{state.set_mem} ({memory.setter} {state.get_mem} ({varid}) ({value})))"
+
+        def array_setter(varid, ind, value):
+            if isinstance(varid, int):
+                varid = memory.key(varid)
+            return state.variable_setter(varid, f"{array.setter} ({state.get_variable} ({varid})) {ind} {value}")
+
+        def printer(value):
+            return f"(λst.{state.set_prnt} (λp.p({value}){state.get_prnt}))"
+
+        def repeater(value, body):
+            return f"({numbers.iterate(value)} ({body}))"
+
+        # Doubt
+        def for_loop(varid, iterable, body):
+            if isinstance(varid, int):
+                varid = memory.key(varid)
+            # arr (g := λst.λx.st') st
+            var_setter = f"{state.set_mem} ({memory.setter} {state.get_mem} {varid} x)"
+            var_setter = state.variable_setter(varid, f"{array.head} l")
+            return f"(λst.{flow.Y} (λF.λl.λst.({array.nonempty} l) (F ({array.tail} l) ({body} ({var_setter} st))) st) ({iterable}) st)"
+
+        def while_loop(expr, body):
+            return f"({flow.Y} (λF.λst.({expr}) (F ({body} st)) st) )"
+
+        def if_statement(expr, true_block, false_block):
+            return f"(λst.{expr} ({true_block} st) ({false_block} st))"
+
+    return memory, array, state
+
+linked_list, array, state = data_structures(numbers)
+
+# Free variables standing for the data structure combinators, computed natively by reducers with delta rules
+# (see lambdac/delta.py) or replaced by their definition otherwise
+primitives = {
+    "$array_get": array.getter,
+    "$array_set": array.setter,
+    "$array_head": array.head,
+    "$array_tail": array.tail,
+    "$array_range": array.range,
+    "$array_fold": array.fold_left,
+    "$list_get": linked_list.getter,
+    "$list_set": linked_list.setter,
+}
+
+# Closed combinators which a program compiled with a prelude binds once to these names, instead of repeating their
+# definition every time it uses them (see magma/to_lambda.py)
+# true and false are left out, they are barely longer than a name
+def library_combinators(numbers, memory, array):
+    return {
+        "flow_Y": flow.Y,
+        "bools_not": bools.notgate,
+        "bools_or": bools.orgate,
+        "bools_and": bools.andgate,
+        "numbers_iszero": numbers.iszero,
+        "numbers_succ": numbers.succ,
+        "numbers_pred": numbers.pred,
+        "numbers_mult": numbers.mult,
+        "numbers_add": numbers.add,
+        "numbers_sub": numbers.sub,
+        "numbers_geq": numbers.geq,
+        "numbers_leq": numbers.leq,
+        "numbers_ge": numbers.ge,
+        "numbers_le": numbers.le,
+        "numbers_eq": numbers.eq,
+        "numbers_div": numbers.div,
+        "numbers_mod": numbers.mod,
+        "pair_first": pair.first,
+        "pair_second": pair.second,
+        f"{memory.name}_get": memory.getter,
+        f"{memory.name}_set": memory.setter,
+        "array_head": array.head,
+        "array_tail": array.tail,
+        "array_get": array.getter,
+        "array_set": array.setter,
+        "array_fold": array.fold_left,
+        "array_range": array.range,
+    }
+
+combinators = library_combinators(numbers, linked_list, array)
+
+# The stdlib for an encoding of numbers (numbers or binary_numbers), with Braun tree arrays and memory with trees
+class library:
+    def __init__(self, numbers, trees=False):
+        self.numbers = numbers
+        self.memory, self.array, self.state = data_structures(numbers, trees)
+        self.combinators = library_combinators(numbers, self.memory, self.array)
+        if numbers is binary_numbers:
+            self.combinators |= {
+                "numbers_double": binary_numbers.double,
+                "numbers_add_carry": binary_numbers.add_carry,
+                "numbers_sub_borrow": binary_numbers.sub_borrow,
+                "numbers_compare": binary_numbers.compare,
+                "numbers_divmod": binary_numbers.divmod,
+                "numbers_pow": binary_numbers.pow,
+                "numbers_repeat": binary_numbers.repeat,
+            }
+        if trees:
+            self.combinators |= {
+                "tree_merge": braun_tree.merge,
+                "tree_cons": braun_tree.cons,
+                "tree_nonempty": braun_tree.nonempty,
+            }
+
+# As picked by the compiler: libraries[binary, trees]
+libraries = {(binary, trees): library(binary_numbers if binary else numbers, trees)
+             for binary in [False, True] for trees in [False, True]}
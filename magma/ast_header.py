@@ -3,7 +3,8 @@ class Repr(type):
         return cls.__name__
 
 class SToken(metaclass=Repr):
-    pass
+    # Line of the statement in the source, set by the parser on statements
+    line = None
 
 class Expression(SToken):
     def __init__(self):
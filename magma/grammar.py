@@ -16,29 +16,33 @@ ArrAss -> Id @ Expr = Expr
 Repeat -> repeat Expr CodeBlock
 Expr -> !Expr|Expr BinaryOp Expr|Id|[Args]|Int|Bool"""
 
+# Cursor over the token list, peeking and consuming are an index and a comparison of integer kinds
 class Stream:
-    def __init__(self, tokenlist):
-        self.tokens = tokenlist
-        self.depth = 0
-
-    def expect(self, tokentype, exact=False):
-        assert self.peek(tokentype, exact)
-        return self.consume()
-    
+    def __init__(self, tokens):
+        self.tokens = list(tokens)
+        self.position = 0
+
+    def expect(self, tokentype):
+        token = self.next
+        assert token.kind == tokentype.kind, f"Expected {tokentype}, got {token} at line {token.line}, column {token.column}"
+        self.position += 1
+        return token
+
     def consume(self):
-        self.depth += 1
-        return self.tokens.pop(0)
-    
-    def peek(self, tokentype, exact=False, lookahead=0):
-        if not exact:
-            val = (self.tokens[lookahead].strn().split(":")[0] == tokentype.strn().split(":")[0])
-        else:
-            val = (self.tokens[lookahead].strn() == tokentype.strn())
-        return val
-    
+        self.position += 1
+        return self.tokens[self.position - 1]
+
+    def peek(self, tokentype, lookahead=0):
+        return self.tokens[self.position + lookahead].kind == tokentype.kind
+
+    # Whether the token lookahead positions away is the operator op
+    def peek_op(self, op, lookahead=0):
+        token = self.tokens[self.position + lookahead]
+        return token.kind == T.Operator.kind and token.op == op
+
     @property
     def next(self):
-        return self.tokens[0]
+        return self.tokens[self.position]
 
 def GBlock(s):
     lines = []
@@ -48,31 +52,34 @@ def GBlock(s):
     return S.CodeBlock(lines)
 
 def GCodeBlock(s):
-    s.expect(T.IndentDelta(1), exact=True)
+    opening = s.expect(T.IndentDelta)
+    assert opening.delta > 0, f"Expected an indented block at line {opening.line}"
     block = GBlock(s)
-    s.expect(T.IndentDelta(-1), exact=True)
+    closing = s.expect(T.IndentDelta)
+    assert closing.delta < 0, f"Expected the end of a block at line {closing.line}"
     return block
 
 def GLine(s):
-    if s.peek(T.For):
-        return GFor(s)
-    elif s.peek(T.While):
-        return GWhile(s)
-    elif s.peek(T.If):
-        return GIf(s)
-    elif s.peek(T.Repeat):
-        return GRepeat(s)
-    elif s.peek(T.Print):
-        return GPrint(s)
-    elif s.peek(T.Operator("="), lookahead=1, exact=True):
+    line = s.next.line
+    tree = GStatement(s)
+    tree.line = line
+    return tree
+
+def GStatement(s):
+    keyword = line_keywords.get(s.next.kind)
+    if keyword is not None:
+        return keyword(s)
+    elif s.peek_op("=", lookahead=1):
         return GAss(s)
-    elif s.peek(T.Operator("@"), lookahead=1, exact=True):
+    elif s.peek_op("@", lookahead=1):
         return GArrAss(s)
     elif maybe_expr(s):
         return GExpr(s)
+    token = s.next
+    raise AssertionError(f"Unexpected {token} at line {token.line}, column {token.column}")
 
 def maybe_expr(s):
-    return s.peek(T.Id) or s.peek(T.Operator("!"), exact=True) or s.peek(T.OpenBracket) or s.peek(T.Int) or s.peek(T.Bool) or s.peek(T.OpenParen)
+    return s.next.kind in prefix_rules and (not s.peek(T.Operator) or s.peek_op("!"))
 
 def GFor(s):
     s.expect(T.For)
@@ -125,15 +132,16 @@ def GPrint(s):
 
 def GAss(s):
     id_obj = s.expect(T.Id)
-    s.expect(T.Operator("="), exact=True)
+    s.consume() # =
     expr = GExpr(s)
     return S.VarAssign(id_obj.name, expr)
 
 def GArrAss(s):
     id_obj = s.expect(T.Id)
-    s.expect(T.Operator("@"))
+    s.consume() # @
     ind = GExpr(s)
-    s.expect(T.Operator("="), exact=True)
+    assert s.peek_op("="), f"Expected = at line {s.next.line}, column {s.next.column}"
+    s.consume()
     expr = GExpr(s)
     return S.ArrAssign(id_obj.name, ind, expr)
 
@@ -143,6 +151,14 @@ def GRepeat(s):
     cb = GCodeBlock(s)
     return S.Repeat(expr, cb)
 
+line_keywords = {
+    T.For.kind: GFor,
+    T.While.kind: GWhile,
+    T.If.kind: GIf,
+    T.Repeat.kind: GRepeat,
+    T.Print.kind: GPrint
+}
+
 operator_priority = {
     "=": -42,
     "||": 1, "&": 1, ",": 1,
@@ -152,49 +168,51 @@ operator_priority = {
     "!": 5, "**": 5
 }
 
+# Pratt parser: the first token of an expression picks its rule in prefix_rules, then binary operators of
+# priority at least prio are folded in from the left, their right operand only taking tighter operators
 def GExpr(s, prio=0):
-    expr = GExprPrefix(s)
+    token = s.consume()
+    rule = prefix_rules.get(token.kind)
+    assert rule is not None, f"Unexpected {token} at line {token.line}, column {token.column}"
+    expr = rule(s, token)
+
+    while s.peek(T.Operator):
+        optype = s.next.op
+        if operator_priority[optype] < prio:
+            break
+        s.consume()
+        right = GExpr(s, operator_priority[optype] + 1)
+        expr = S.BinaryOperator(expr, optype, right)
 
-    while True:
-        if s.peek(T.Operator):
-            optype = s.next.op
-            if operator_priority[optype] < prio:
-                break
+    return expr
 
-            s.consume()
-            right = GExpr(s, operator_priority[optype] + 1)
-            expr = S.BinaryOperator(expr, optype, right)
-        else:
-            break
-    
+def GNot(s, token):
+    assert token.op == "!", f"Unexpected {token} at line {token.line}, column {token.column}"
+    return S.Not(GExpr(s, operator_priority["!"]))
+
+def GArray(s, token):
+    expr = GExpr(s)
+    s.expect(T.CloseBracket)
+    elems = []
+    while isinstance(expr, S.BinaryOperator) and expr.op == ",":
+        elems.append(expr.right)
+        expr = expr.left
+    elems.append(expr)
+    return S.Array(elems[::-1])
+
+def GParens(s, token):
+    expr = GExpr(s)
+    s.expect(T.CloseParen)
     return expr
 
-def GExprPrefix(s):
-    if s.peek(T.Operator("!"), exact=True):
-        s.consume()
-        expr = GExpr(s, operator_priority["!"])
-        return S.Not(expr)
-    elif s.peek(T.OpenBracket):
-        s.consume()
-        expr = GExpr(s)
-        s.expect(T.CloseBracket)
-        elems = []
-        while isinstance(expr, S.BinaryOperator) and expr.op == ",":
-            elems.append(expr.right)
-            expr = expr.left
-        elems.append(expr)
-        return S.Array(elems[::-1])
-    elif s.peek(T.Int):
-        return S.IntLiteral(s.consume().num)
-    elif s.peek(T.Id):
-        return S.Var(s.consume().name)
-    elif s.peek(T.Bool):
-        return S.BoolLiteral(s.consume().val)
-    elif s.peek(T.OpenParen):
-        s.consume()
-        expr = GExpr(s)
-        s.expect(T.CloseParen)
-        return expr
+prefix_rules = {
+    T.Operator.kind: GNot,
+    T.OpenBracket.kind: GArray,
+    T.OpenParen.kind: GParens,
+    T.Int.kind: lambda s, token: S.IntLiteral(token.num),
+    T.Id.kind: lambda s, token: S.Var(token.name),
+    T.Bool.kind: lambda s, token: S.BoolLiteral(token.val)
+}
 
 def parse_tokens(tokens):
     return GBlock(Stream(tokens))
\ No newline at end of file
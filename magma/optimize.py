@@ -0,0 +1,185 @@
+import magma.ast_header as ast
+
+# Evaluation at compile time of what only depends on literals, which would otherwise be computed on Church
+# numerals by reduction every time it runs: constant operations are folded, the values of variables assigned a
+# constant are propagated to the code which follows, and the branches of ifs which cannot run are dropped
+# The program keeps every assignment, its final state is the same
+
+# Larger results are left to be computed when running, their numerals (or arrays) would make the code huge
+largest_literal = 1 << 12
+longest_range = 64
+
+def int_value(expr):
+    return expr.value if isinstance(expr, ast.IntLiteral) else None
+
+def bool_value(expr):
+    return expr.value == "true" if isinstance(expr, ast.BoolLiteral) else None
+
+def is_literal(expr):
+    return isinstance(expr, (ast.IntLiteral, ast.BoolLiteral))
+
+def same_literal(a, b):
+    return type(a) == type(b) and a.value == b.value
+
+def literal(value):
+    if isinstance(value, bool):
+        return ast.BoolLiteral("true" if value else "false")
+    return ast.IntLiteral(value)
+
+# None where the stdlib combinator does not compute a number
+arithmetic = {
+    "+": lambda a, b: a + b,
+    "-": lambda a, b: max(a - b, 0), # Numerals stop at 0
+    "*": lambda a, b: a * b,
+    "/": lambda a, b: a // b if b > 0 else None, # Dividing by 0 never terminates
+    "%": lambda a, b: a % b if b > 0 else None,
+    "**": lambda a, b: a ** b if 0 < b <= 64 else None, # n ** 0 is λa.a, not a numeral
+    "<": lambda a, b: a < b,
+    ">": lambda a, b: a > b,
+    "<=": lambda a, b: a <= b,
+    ">=": lambda a, b: a >= b,
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+}
+
+logic = {
+    "||": lambda a, b: a or b,
+    "&": lambda a, b: a and b,
+}
+
+# Literal for op applied to left and right, None if it cannot be computed here
+def fold_operator(op, left, right):
+    a, b = int_value(left), int_value(right)
+    if a is not None and b is not None:
+        if op in arithmetic:
+            value = arithmetic[op](a, b)
+            if value is None or (not isinstance(value, bool) and value > largest_literal):
+                return None
+            return literal(value)
+        # range n m only stops once it reaches m
+        if op == ".." and a <= b < a + longest_range and b <= largest_literal:
+            return ast.Array([ast.IntLiteral(i) for i in range(a, b + 1)])
+        return None
+    p, q = bool_value(left), bool_value(right)
+    if op in logic and p is not None and q is not None:
+        return literal(logic[op](p, q))
+    return None
+
+# env: name -> literal value of the variables known at this point of the program
+# Folded bottom up on an explicit stack, a chain of operators (a + b + c...) being as deep as it is long: an
+# operation is pushed again with built set under its operands, and folded once they are on top of results
+def fold_expr(expr, env):
+    results = []
+    stack = [(expr, False)]
+    while len(stack) > 0:
+        expr, built = stack.pop()
+        if built:
+            if isinstance(expr, ast.Not):
+                inner = results.pop()
+                value = bool_value(inner)
+                results.append(literal(not value) if value is not None else ast.Not(inner))
+            elif isinstance(expr, ast.Array):
+                inner = results[len(results) - len(expr.inner):]
+                del results[len(results) - len(expr.inner):]
+                results.append(ast.Array(inner))
+            else:
+                right = results.pop()
+                left = results.pop()
+                folded = fold_operator(expr.op, left, right)
+                results.append(folded if folded is not None else ast.BinaryOperator(left, expr.op, right))
+        elif isinstance(expr, ast.Var):
+            results.append(env.get(expr.name, expr))
+        elif isinstance(expr, (ast.Not, ast.Array, ast.BinaryOperator)):
+            stack.append((expr, True))
+            stack += [(child, False) for child in reversed(expr.children())]
+        else:
+            results.append(expr)
+    return results[0]
+
+# Names of the variables tree assigns to somewhere
+def assigned(tree, names):
+    stack = [tree]
+    while len(stack) > 0:
+        tree = stack.pop()
+        if isinstance(tree, (ast.VarAssign, ast.ArrAssign)):
+            names.add(tree.varname)
+        elif isinstance(tree, ast.For):
+            names.add(tree.var)
+        stack += tree.children()
+    return names
+
+def forget(env, tree):
+    for name in assigned(tree, set()):
+        env.pop(name, None)
+
+def block_lines(tree):
+    # Else blocks of elifs are an If instead of a block
+    return tree.lines if isinstance(tree, ast.CodeBlock) else [tree]
+
+def optimize_lines(lines, env):
+    optimized = []
+    for line in lines:
+        for tree in optimize_line(line, env):
+            # Statements built anew keep the line of the one they replace
+            if tree.line is None:
+                tree.line = line.line
+            optimized.append(tree)
+    return optimized
+
+# Statements replacing tree, env is updated to what is known after it
+def optimize_line(tree, env):
+    if isinstance(tree, ast.VarAssign):
+        expr = fold_expr(tree.expr, env)
+        if is_literal(expr):
+            env[tree.varname] = expr
+        else:
+            env.pop(tree.varname, None)
+        return [ast.VarAssign(tree.varname, expr)]
+    elif isinstance(tree, ast.ArrAssign):
+        ind = fold_expr(tree.ind, env)
+        expr = fold_expr(tree.expr, env)
+        env.pop(tree.varname, None)
+        return [ast.ArrAssign(tree.varname, ind, expr)]
+    elif isinstance(tree, ast.Print):
+        return [ast.Print(fold_expr(tree.expr, env))]
+    elif isinstance(tree, ast.If):
+        cond = fold_expr(tree.cond, env)
+        value = bool_value(cond)
+        if value is True:
+            return optimize_lines(tree.block.lines, env)
+        elif value is False:
+            return optimize_lines(block_lines(tree.elseblock), env) if tree.elseblock is not None else []
+        else_env = dict(env)
+        block = ast.CodeBlock(optimize_lines(tree.block.lines, env))
+        elseblock = None
+        if tree.elseblock is not None:
+            elseblock = ast.CodeBlock(optimize_lines(block_lines(tree.elseblock), else_env))
+        # Only what both branches agree on is known after the if
+        for name in list(env):
+            if name not in else_env or not same_literal(env[name], else_env[name]):
+                del env[name]
+        return [ast.If(cond, block, elseblock)]
+    elif isinstance(tree, ast.While):
+        if bool_value(fold_expr(tree.cond, env)) is False:
+            return []
+        # The condition and the body are also run after the body, when what it assigns is not known anymore
+        forget(env, tree.block)
+        cond = fold_expr(tree.cond, env)
+        return [ast.While(cond, ast.CodeBlock(optimize_lines(tree.block.lines, dict(env))))]
+    elif isinstance(tree, ast.For):
+        iterator = fold_expr(tree.iterator, env)
+        forget(env, tree)
+        return [ast.For(tree.var, iterator, ast.CodeBlock(optimize_lines(tree.block.lines, dict(env))))]
+    elif isinstance(tree, ast.Repeat):
+        counter = fold_expr(tree.counter, env)
+        count = int_value(counter)
+        if count == 0:
+            return []
+        elif count == 1:
+            return optimize_lines(tree.block.lines, env)
+        forget(env, tree.block)
+        return [ast.Repeat(counter, ast.CodeBlock(optimize_lines(tree.block.lines, dict(env))))]
+    return [tree]
+
+def optimize(tree):
+    return ast.CodeBlock(optimize_lines(tree.lines, {}))
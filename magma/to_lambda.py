@@ -1,5 +1,7 @@
 import magma.ast_header as ast 
 import lambdac.stdlib as std
+import lambdac.parser as lcp
+import lambdac.reducer as lcr
 
 def flatten_commas(expr):
     if isinstance(expr, ast.BinaryOperator) and expr.op == ",":
@@ -7,106 +9,287 @@ def flatten_commas(expr):
     return [expr]
 
 def compose(funcs):
-    # Converts [f, g, h, x] into f (g (h x))
-    if len(funcs) == 1:
-        return funcs[0]
-    return f"{funcs[0]} ({compose(funcs[1:])})"
+    # Converts [f, g, h, x] into f (g (h x)), built flat since blocks can be thousands of lines long
+    return " (".join(funcs) + ")" * (len(funcs) - 1)
+
+def replace_primitives(lambd):
+    # Data structure combinators replaced by native primitives, longest first as they are built out of each other
+    for name, combinator in sorted(std.primitives.items(), key=lambda item: len(item[1]), reverse=True):
+        lambd = lambd.replace(combinator, name)
+    return lambd
+
+def replace_combinators(lambd, lib, used):
+    # Stdlib combinators replaced by the names the prelude binds them to, longest first as well
+    # The names of those found are added to used
+    for name, combinator in sorted(lib.combinators.items(), key=lambda item: len(item[1]), reverse=True):
+        if combinator in lambd:
+            lambd = lambd.replace(combinator, name)
+            used.add(name)
+    return lambd
+
+# (name, definition) of the combinators bound by the prelude of a program using those in used
+# Definitions are the full closed text of the combinators, so that the delta rules still recognize them
+def prelude_bindings(lib, used):
+    return [(name, combinator) for name, combinator in lib.combinators.items() if name in used]
 
 class NotSupported(Exception):
     pass
 
-def compile_expr(expr: ast.Expression, varhash: dict):
-    if isinstance(expr, ast.BinaryOperator):
-        op = expr.op
-        left = compile_expr(expr.left, varhash)
-        right = compile_expr(expr.right, varhash)
-        if op == "+": return f"({std.numbers.add} {left} {right})"
-        elif op == "*": return f"({std.numbers.mult} {left} {right})"
-        elif op == "**": return f"({right} {left})"
-        elif op == "-": return f"({std.numbers.sub} {left} {right})"
-        elif op == "/": return f"({std.numbers.div} {left} {right})"
-        elif op == "%": return f"({std.numbers.mod} {left} {right})"
-        elif op == "<": return f"({std.numbers.le} {left} {right})"
-        elif op == ">": return f"({std.numbers.ge} {left} {right})"
-        elif op == "<=": return f"({std.numbers.leq} {left} {right})"
-        elif op == ">=": return f"({std.numbers.geq} {left} {right})"
-        elif op == "==": return f"({std.numbers.eq} {left} {right})"
-        elif op == "!=": return f"({std.bools.notgate} ({std.numbers.eq} {left} {right}))"
-        elif op == "||": return f"({std.bools.orgate} {left} {right})"
-        elif op == "&": return f"({std.bools.andgate} {left} {right})"
-        elif op == "..": return f"({std.array.range} {left} {right})"
-        elif op == "@": return f"({std.array.getter} {left} {right})"
-    elif isinstance(expr, ast.BoolLiteral):
-        if expr.value == "true": return std.true
-        return std.false
-    elif isinstance(expr, ast.IntLiteral):
-        return std.numbers.make(expr.value)
-    elif isinstance(expr, ast.Not):
-        return f"({std.bools.notgate} {compile_expr(expr.expr, varhash)})"
-    elif isinstance(expr, ast.Var):
-        return f"({std.state.get_variable} {std.numbers.make(varhash[expr.name])})"
-    elif isinstance(expr, ast.Array):
-        return std.array.make([compile_expr(i, varhash) for i in expr.inner])
-
-def compile_tree(tree: ast.SToken, varhash: dict):
+# The code of the program is put together by a builder out of the text of the stdlib functions:
+# call(f, *args) is the code f(*args) for code arguments (and ints or strings, which are part of the text),
+# block(chunks) the composition of the state functions in chunks
+# TextBuilder writes it out as text, TreeBuilder builds the term itself
+# lib is the stdlib they use, on bit lists rather than Church numerals with binary, and Braun trees rather than
+# lists with trees
+# With prelude, the program is wrapped in λs binding each stdlib combinator it uses to a name, applied to their
+# definitions, and only refers to them by name
+# line is that of the statement being compiled, TreeBuilder tags the nodes it builds for it with the line and the
+# origin of their code for lambdac/profiler.py
+
+class TextBuilder:
+    def __init__(self, primitives=False, prelude=False, binary=False, trees=False):
+        self.primitives = primitives
+        self.prelude = prelude
+        self.lib = std.libraries[binary, trees]
+        self.line = None
+
+    def call(self, f, *args):
+        return f(*args)
+
+    def block(self, chunks):
+        return "(λst." + compose(chunks[::-1] + ["st"]) + ")"
+
+    def program(self, code, memsize):
+        lambd = f"({code}) {self.lib.state.make(memsize)}"
+        if self.primitives:
+            lambd = replace_primitives(lambd)
+        if self.prelude:
+            used = set()
+            lambd = replace_combinators(lambd, self.lib, used)
+            bindings = prelude_bindings(self.lib, used)
+            if len(bindings) > 0:
+                binders = "".join(f"λ{name}." for name, _ in bindings)
+                lambd = f"({binders}{lambd}) " + " ".join(combinator for _, combinator in bindings)
+        return lambd
+
+# The text of each stdlib function is only parsed once for each combination of its non code arguments, with a
+# hole (a free variable $0, $1...) where each code argument goes, and interned
+# The term is a copy of the template with the holes filled in, in which its closed subterms are shared: every
+# combinator is a single node for the whole program, as with InternTable.intern on the parsed text
+# Subterms with free variables are always copied, these may be bound by the code around the template
+# Nothing may reduce the templates in the meantime, a builder is used for a single program
+class TreeBuilder:
+    def __init__(self, primitives=False, prelude=False, binary=False, trees=False):
+        self.primitives = primitives
+        self.prelude = prelude
+        self.lib = std.libraries[binary, trees]
+        self.used = set() # Combinators referred to by name in the templates, with prelude
+        self.table = lcp.InternTable()
+        self.templates = {}
+        self.line = None
+
+    def parse(self, lambd):
+        return self.table.intern(lcp.parse_lambda_term(lcp.Stream(lcp.lex(lambd))))
+
+    def template(self, f, args):
+        key = (f,) + tuple(None if isinstance(a, lcp.LambdaTerm) else a for a in args)
+        if key not in self.templates:
+            lambd = f(*(f"${i}" if isinstance(a, lcp.LambdaTerm) else a for i, a in enumerate(args)))
+            if self.primitives:
+                lambd = replace_primitives(lambd)
+            if self.prelude:
+                lambd = replace_combinators(lambd, self.lib, self.used)
+            self.templates[key] = self.parse(lambd)
+        return self.templates[key]
+
+    def call(self, f, *args):
+        template = self.template(f, args)
+        holes = {f"${i}": a for i, a in enumerate(args) if isinstance(a, lcp.LambdaTerm)}
+        copies = {} # id(node) -> its copy
+        tag = (self.line, origin(f))
+        def copy(term):
+            node = lcp.Node(term)
+            node.tag = tag
+            return node
+        stack = [template]
+        while len(stack) > 0:
+            node = stack[-1]
+            t = node.unwrap()
+            if id(node) in copies:
+                pass
+            elif len(lcr.free_variables(node)) == 0:
+                copies[id(node)] = node
+            elif t.type == "var":
+                copies[id(node)] = holes[t.var] if t.var in holes else copy(lcp.Variable(t.var))
+            elif t.type == "lambda":
+                if id(t.body) not in copies:
+                    stack.append(t.body)
+                    continue
+                copies[id(node)] = copy(lcp.Abstraction(t.arg, copies[id(t.body)]))
+            else:
+                if id(t.left) not in copies or id(t.right) not in copies:
+                    stack.append(t.right)
+                    stack.append(t.left)
+                    continue
+                copies[id(node)] = copy(lcp.Application(copies[id(t.left)], copies[id(t.right)]))
+            stack.pop()
+        return copies[id(template)]
+
+    def block(self, chunks):
+        term = lcp.Node(lcp.Variable("st"))
+        for chunk in chunks:
+            term = lcp.Node(lcp.Application(chunk, term))
+        return lcp.Node(lcp.Abstraction("st", term))
+
+    def program(self, code, memsize):
+        memory = self.call(self.lib.state.make, memsize)
+        term = lcp.Node(lcp.Application(code, memory))
+        bindings = prelude_bindings(self.lib, self.used)
+        for name, _ in bindings[::-1]:
+            term = lcp.Node(lcp.Abstraction(name, term))
+        for _, combinator in bindings:
+            term = lcp.Node(lcp.Application(term, self.parse(combinator)))
+        return self.table.intern(term)
+
+binary_operators = {
+    "+": lambda lib, left, right: f"({lib.numbers.add} {left} {right})",
+    "*": lambda lib, left, right: f"({lib.numbers.mult} {left} {right})",
+    "**": lambda lib, left, right: lib.numbers.power(left, right),
+    "-": lambda lib, left, right: f"({lib.numbers.sub} {left} {right})",
+    "/": lambda lib, left, right: f"({lib.numbers.div} {left} {right})",
+    "%": lambda lib, left, right: f"({lib.numbers.mod} {left} {right})",
+    "<": lambda lib, left, right: f"({lib.numbers.le} {left} {right})",
+    ">": lambda lib, left, right: f"({lib.numbers.ge} {left} {right})",
+    "<=": lambda lib, left, right: f"({lib.numbers.leq} {left} {right})",
+    ">=": lambda lib, left, right: f"({lib.numbers.geq} {left} {right})",
+    "==": lambda lib, left, right: f"({lib.numbers.eq} {left} {right})",
+    "!=": lambda lib, left, right: f"({std.bools.notgate} ({lib.numbers.eq} {left} {right}))",
+    "||": lambda lib, left, right: f"({std.bools.orgate} {left} {right})",
+    "&": lambda lib, left, right: f"({std.bools.andgate} {left} {right})",
+    "..": lambda lib, left, right: f"({lib.array.range} {left} {right})",
+    "@": lambda lib, left, right: f"({lib.array.getter} {left} {right})",
+}
+
+operator_names = {f: op for op, f in binary_operators.items()}
+
+# Where the code built by f comes from, the stdlib function (state.for_loop, numbers.make...) or the operator
+def origin(f):
+    if f in operator_names:
+        return f"operator {operator_names[f]}"
+    return ".".join(f.__qualname__.split(".")[-2:])
+
+def boolean(value):
+    return std.true if value == "true" else std.false
+
+def negation(expr):
+    return f"({std.bools.notgate} {expr})"
+
+def variable(lib, varid):
+    return f"({lib.state.get_variable} {lib.memory.key(varid)})"
+
+def array(lib, *inner):
+    return lib.array.make(list(inner))
+
+# Compiled bottom up on an explicit stack, as optimize.fold_expr folds: an operation is pushed again with built set
+# under its operands, left first, and built once their code is on top of results
+def compile_expr(expr: ast.Expression, varhash: dict, build):
+    results = []
+    stack = [(expr, False)]
+    while len(stack) > 0:
+        expr, built = stack.pop()
+        if built:
+            if isinstance(expr, ast.BinaryOperator):
+                right = results.pop()
+                left = results.pop()
+                results.append(build.call(binary_operators[expr.op], build.lib, left, right))
+            elif isinstance(expr, ast.Not):
+                results.append(build.call(negation, results.pop()))
+            else:
+                inner = results[len(results) - len(expr.inner):]
+                del results[len(results) - len(expr.inner):]
+                results.append(build.call(array, build.lib, *inner))
+        elif isinstance(expr, ast.BoolLiteral):
+            results.append(build.call(boolean, expr.value))
+        elif isinstance(expr, ast.IntLiteral):
+            results.append(build.call(build.lib.numbers.make, expr.value))
+        elif isinstance(expr, ast.Var):
+            results.append(build.call(variable, build.lib, varhash[expr.name]))
+        else:
+            stack.append((expr, True))
+            stack += [(child, False) for child in reversed(expr.children())]
+    return results[0]
+
+def compile_tree(tree: ast.SToken, varhash: dict, build):
     if isinstance(tree, ast.CodeBlock):
-        chunks = [compile_tree(t, varhash) for t in tree.lines]
+        chunks = [compile_tree(t, varhash, build) for t in tree.lines]
         if len(chunks) == 1:
             return chunks[0]
-        return "λst." + compose(chunks[::-1] + ["st"])
-    elif isinstance(tree, ast.For):
-        expr = compile_expr(tree.iterator, varhash)
-        body = compile_tree(tree.block, varhash)
-        return std.state.for_loop(varhash[tree.var], expr, body)
+        return build.block(chunks)
+    # Code is built on the line of its statement, back on the line of the one around it afterwards
+    outer = build.line
+    if tree.line is not None:
+        build.line = tree.line
+    code = compile_statement(tree, varhash, build)
+    build.line = outer
+    return code
+
+def compile_statement(tree: ast.SToken, varhash: dict, build):
+    if isinstance(tree, ast.For):
+        expr = compile_expr(tree.iterator, varhash, build)
+        body = compile_tree(tree.block, varhash, build)
+        return build.call(build.lib.state.for_loop, varhash[tree.var], expr, body)
     elif isinstance(tree, ast.If):
-        expr = compile_expr(tree.cond, varhash)
-        trueblock = compile_tree(tree.block, varhash)
-        falseblock = compile_tree(tree.elseblock, varhash) if tree.elseblock is not None else ""
-        return std.state.if_statement(expr, trueblock, falseblock)
+        expr = compile_expr(tree.cond, varhash, build)
+        trueblock = compile_tree(tree.block, varhash, build)
+        falseblock = compile_tree(tree.elseblock, varhash, build) if tree.elseblock is not None else ""
+        return build.call(build.lib.state.if_statement, expr, trueblock, falseblock)
     elif isinstance(tree, ast.Print):
-        expr = compile_expr(tree.expr, varhash)
-        return std.state.printer(expr)
+        expr = compile_expr(tree.expr, varhash, build)
+        return build.call(build.lib.state.printer, expr)
     elif isinstance(tree, ast.Repeat):
-        expr = compile_expr(tree.counter, varhash)
-        body = compile_tree(tree.block, varhash)
-        return std.state.repeater(expr, body)
+        expr = compile_expr(tree.counter, varhash, build)
+        body = compile_tree(tree.block, varhash, build)
+        return build.call(build.lib.state.repeater, expr, body)
     elif isinstance(tree, ast.VarAssign):
         varid = varhash[tree.varname]
-        value = compile_expr(tree.expr, varhash)
-        return std.state.variable_setter(varid, value)
+        value = compile_expr(tree.expr, varhash, build)
+        return build.call(build.lib.state.variable_setter, varid, value)
     elif isinstance(tree, ast.ArrAssign):
         varid = varhash[tree.varname]
-        ind = compile_expr(tree.ind, varhash)
-        value = compile_expr(tree.expr, varhash)
-        return std.state.array_setter(varid, ind, value)
+        ind = compile_expr(tree.ind, varhash, build)
+        value = compile_expr(tree.expr, varhash, build)
+        return build.call(build.lib.state.array_setter, varid, ind, value)
     elif isinstance(tree, ast.While):
-        expr = compile_expr(tree.cond, varhash)
-        body = compile_tree(tree.block, varhash)
-        return std.state.while_loop(expr, body)
+        expr = compile_expr(tree.cond, varhash, build)
+        body = compile_tree(tree.block, varhash, build)
+        return build.call(build.lib.state.while_loop, expr, body)
 
 def incr_tbl(id, tbl):
     tbl[id] = tbl.get(id, 0) + 1
  
+# In the order of the source, which breaks the ties between variables used as often (see variable_ids)
 def count_vars(tree, tbl):
-    if isinstance(tree, ast.Var):
-        incr_tbl(tree.name, tbl)
-    if isinstance(tree, ast.VarAssign):
-        incr_tbl(tree.varname, tbl)
-        count_vars(tree.expr, tbl)
-    if isinstance(tree, ast.ArrAssign):
-        incr_tbl(tree.varname, tbl)
-        count_vars(tree.ind, tbl)
-        count_vars(tree.expr, tbl)
-    if isinstance(tree, ast.For):
-        incr_tbl(tree.var, tbl)
-        count_vars(tree.iterator, tbl)
-        count_vars(tree.block, tbl)
-    else:
-        for c in tree.children():
-            count_vars(c, tbl)
-
-def compile(tree):
-    # Calculate the varhash, with most common variables having smaller numbers (slight optimisation)
+    stack = [tree]
+    while len(stack) > 0:
+        tree = stack.pop()
+        walked = []
+        if isinstance(tree, ast.Var):
+            incr_tbl(tree.name, tbl)
+        if isinstance(tree, ast.VarAssign):
+            incr_tbl(tree.varname, tbl)
+            walked.append(tree.expr)
+        if isinstance(tree, ast.ArrAssign):
+            incr_tbl(tree.varname, tbl)
+            walked += [tree.ind, tree.expr]
+        if isinstance(tree, ast.For):
+            incr_tbl(tree.var, tbl)
+            walked += [tree.iterator, tree.block]
+        else:
+            walked += tree.children()
+        stack += reversed(walked)
+
+# Index of each variable in memory, with most common variables having smaller numbers (slight optimisation)
+def variable_ids(tree):
     varcount = dict()
     count_vars(tree, varcount)
     varcount = sorted(varcount.items(), key=lambda item: item[1], reverse=True)
@@ -115,4 +298,16 @@ def compile(tree):
     for (v, _) in varcount:
         varhash[v] = i
         i += 1
-    return f"({compile_tree(tree, varhash)}) {std.state.make(i)}"
\ No newline at end of file
+    return varhash
+
+def compile_program(tree, build):
+    varhash = variable_ids(tree)
+    return build.program(compile_tree(tree, varhash, build), len(varhash))
+
+# Text of the lambda term of the program
+def compile(tree, primitives=False, prelude=False, binary=False, trees=False):
+    return compile_program(tree, TextBuilder(primitives, prelude, binary, trees))
+
+# The lambda term of the program itself, with its closed subterms interned
+def compile_term(tree, primitives=False, prelude=False, binary=False, trees=False):
+    return compile_program(tree, TreeBuilder(primitives, prelude, binary, trees))
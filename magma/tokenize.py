@@ -1,13 +1,21 @@
-import regex
+import re
 
 class Repr(type):
     def __repr__(cls):
         return cls.__name__
 
+# Tokens know where they start in the source, line and column counting from 1
 class Token(metaclass=Repr):
-    @classmethod
-    def strn(self=None):
-        return self.__name__
+    line = None
+    column = None
+
+    def at(self, line, column):
+        self.line = line
+        self.column = column
+        return self
+
+    def __repr__(self):
+        return type(self).__name__
 
 class Id(Token):
     def __init__(self, name):
@@ -20,11 +28,6 @@ class Int(Token):
     def __init__(self, num):
         self.num = num
     
-    def strn(self=None):
-        if self == None:
-            return "Int"
-        return f"Int:{self.num}"
-
     def __repr__(self):
         return f"Int<{self.num}>"
     
@@ -32,11 +35,6 @@ class Bool(Token):
     def __init__(self, val):
         self.val = val
     
-    def strn(self=None):
-        if self == None:
-            return "Bool"
-        return f"Bool:{self.val}"
-    
     def __repr__(self):
         return f"Bool<{self.val}>"
 
@@ -44,11 +42,6 @@ class Operator(Token):
     def __init__(self, op):
         self.op = op
     
-    def strn(self=None):
-        if self == None:
-            return "Op"
-        return f"Op:{self.op}"
-    
     def __repr__(self):
         return f"Op<{self.op}>"
 
@@ -56,11 +49,6 @@ class IndentDelta(Token):
     def __init__(self, delta):
         self.delta = delta
     
-    def strn(self=None):
-        if self == None:
-            return "Delta"
-        return f"Delta:{self.delta / abs(self.delta)}"
-
     def __repr__(self):
         return f"Delta<{self.delta}>"
 
@@ -103,27 +91,13 @@ class OpenParen(Token):
 class CloseParen(Token):
     pass
 
-class Indent(Token):
-    pass
-
-class Space(Token):
-    pass
-
-class NewLine(Token):
-    pass
-
-lexem_to_token = {
-    "\n": NewLine,
-    "(": OpenParen,
-    ")": CloseParen,
-    "[": OpenBracket,
-    "]": CloseBracket,
-    " ": Space,
-    "\t": Indent
-}
+# The parser tells tokens apart by an integer kind, set on each class
+token_classes = [Id, Int, Bool, Operator, IndentDelta, EOF, Print, If, Elif, Else, For, In, Repeat, While,
+                 OpenBracket, CloseBracket, OpenParen, CloseParen]
+for kind, token_class in enumerate(token_classes):
+    token_class.kind = kind
 
 operators = ["=", "*", "**", "+", "-", "/", "%", "&", "||", "!", "<", ">", "<=", ">=", "==", "!=", "..", ",", "@"]
-special_characters = "=*+-/%&|!<>.,@"
 
 keywords = {
     "if": If,
@@ -136,106 +110,91 @@ keywords = {
     "in": In
 }
 
-def buffer_to_token(buffer):
-    if buffer.isnumeric():
-        return Int(int(buffer))
-    if buffer in keywords:
-        return keywords[buffer]
-    if buffer in operators:
-        return Operator(buffer)
-    if buffer in ["true", "false"]:
-        return Bool(buffer)
-    if regex.match(r"\w(\w|\d|_)*", buffer):
-        return Id(buffer)
-
-def clear_buffer(buffer, tokens):
-    new_token = buffer_to_token(buffer)
-
-    if new_token is not None:
-        return "", tokens + [new_token]
-    return "", tokens
-
-def tokenize(src: str):
-    buffer = ""
-    # -1 for arbitrary
-    # 0 for text/numbers
-    # 1 for special characters
-    buffer_type = -1
-    tokens = []
-    for c in src:
-        if c in lexem_to_token:
-            buffer, tokens = clear_buffer(buffer, tokens)
-            buffer_type = -1
-            tokens.append(lexem_to_token[c])
-        elif c in special_characters:
-            if buffer_type != 1:
-                buffer, tokens = clear_buffer(buffer, tokens)
-            buffer += c
-            buffer_type = 1
-        else:
-            if buffer_type != 0:
-                buffer, tokens = clear_buffer(buffer, tokens)
-            buffer += c
-            buffer_type = 0
-    buffer, tokens = clear_buffer(buffer, tokens)
-
-    return tokens
+brackets = {
+    "(": OpenParen,
+    ")": CloseParen,
+    "[": OpenBracket,
+    "]": CloseBracket
+}
 
-def handle_negative_deltas(delta_stack, tokens, Δ):
+# Every lexeme in one pattern, the name of the group which matched telling which kind it is
+# Operators are tried longest first, characters which are part of nothing are skipped
+lexemes = re.compile("|".join([
+    r"(?P<newline>\r?\n)",
+    r"(?P<space>[ \t\r]+)",
+    r"(?P<word>\w+)",
+    "(?P<operator>" + "|".join(re.escape(op) for op in sorted(operators, key=len, reverse=True)) + ")",
+    r"(?P<bracket>[()\[\]])",
+    r"(?P<other>.)",
+]))
+
+def word_token(word):
+    if word.isdigit():
+        return Int(int(word))
+    if word in keywords:
+        return keywords[word]()
+    if word in ["true", "false"]:
+        return Bool(word)
+    return Id(word)
+
+def closing_deltas(delta_stack, Δ):
     while Δ < 0:
         latest_up = delta_stack.pop()
         Δ += latest_up
-        tokens.append(IndentDelta(-latest_up))
+        yield IndentDelta(-latest_up)
 
-def indentation_handler(input_tokens):
-    # Remove unnecessary Space tokens
+# Yields the tokens of src, with indentation turned into IndentDelta instances and an EOF at the end
+# IndentDelta(0) means same level as previous code
+# Newlines between opening and closing parenthesises/brackets are considered to be cosmetic and thus ignored
+def tokenize(src: str):
+    line, line_start = 1, 0
     just_newlined = True
-    despaced_tokens = []
-    for token in input_tokens:
-        if token in [Space, Indent]:
-            if just_newlined:
-                # Count indents as two spaces, not very sophisticated
-                despaced_tokens += [Space] * (1 if token == Space else 2)
-        elif token == NewLine:
-            just_newlined = True
-            despaced_tokens.append(NewLine)
-        else:
-            just_newlined = False
-            despaced_tokens.append(token)
-
-    # Replace newlines and spaces with IndentDelta instances
-    # IndentDelta(0) means same level as previous code
-    # Newlines between opening and closing parenthesises/brackets are considered to be cosmetic and thus ignored
     bracket_depth = 0 # Includes brackets and parenthesises, does not Dyck-validate
     indent_level = 0
-    local_indent_level = -1
+    local_indent_level = -1 # Indent of the current line until its first token, -1 after that
     delta_stack = []
 
-    tokens = []
-    for token in despaced_tokens:
-        if token == NewLine:
-            if bracket_depth == 0: local_indent_level = 0
-        elif token == Space:
-            if bracket_depth == 0: local_indent_level += 1
+    for m in lexemes.finditer(src):
+        kind = m.lastgroup
+        if kind == "newline":
+            line, line_start = line + 1, m.end()
+            just_newlined = True
+            if bracket_depth == 0:
+                local_indent_level = 0
+            continue
+        if kind == "space":
+            if just_newlined and bracket_depth == 0:
+                # Count indents as two spaces, not very sophisticated
+                local_indent_level += m.group().count(" ") + 2 * m.group().count("\t")
+            continue
+        if kind == "other":
+            continue
+
+        column = m.start() - line_start + 1
+        lexeme = m.group()
+        if kind == "word":
+            token = word_token(lexeme)
+        elif kind == "operator":
+            token = Operator(lexeme)
         else:
-            if local_indent_level != -1: # only triggers at most once per line
-                Δ = local_indent_level - indent_level
-                if Δ > 0:
-                    tokens.append(IndentDelta(Δ))
-                    delta_stack.append(Δ)
-                elif Δ < 0: # add multiple negative deltas in case of closing multiple blocks at once
-                    handle_negative_deltas(delta_stack, tokens, Δ)
-                indent_level = local_indent_level
-                local_indent_level = -1 # prevent next token in line from handling the indent
-            if token in [OpenBracket, OpenParen]:
-                bracket_depth += 1
-                tokens.append(token)
-            elif token in [CloseBracket, CloseParen]:
-                bracket_depth -= 1
-                tokens.append(token)
-            else:
-                tokens.append(token)
-    handle_negative_deltas(delta_stack, tokens, -indent_level)
-    tokens.append(EOF)
-
-    return tokens
\ No newline at end of file
+            token = brackets[lexeme]()
+        just_newlined = False
+
+        if local_indent_level != -1: # only triggers at most once per line
+            Δ = local_indent_level - indent_level
+            if Δ > 0:
+                yield IndentDelta(Δ).at(line, column)
+                delta_stack.append(Δ)
+            elif Δ < 0: # add multiple negative deltas in case of closing multiple blocks at once
+                for delta in closing_deltas(delta_stack, Δ):
+                    yield delta.at(line, column)
+            indent_level = local_indent_level
+            local_indent_level = -1 # prevent next token in line from handling the indent
+        if kind == "bracket":
+            bracket_depth += 1 if lexeme in "([" else -1
+        yield token.at(line, column)
+
+    column = len(src) - line_start + 1
+    for delta in closing_deltas(delta_stack, -indent_level):
+        yield delta.at(line, column)
+    yield EOF().at(line, column)
@@ -2,53 +2,278 @@ import sys
 import time
 
 import lambdac.parser as lcp
+import lambdac.binary as lcbin
 import lambdac.reducer as lcr
+import lambdac.graph as lcg
+import lambdac.debruijn as lcd
+import lambdac.machine as lcm
+import lambdac.nbe as lcn
+import lambdac.delta as lcdelta
+import lambdac.memo as lcmemo
+import lambdac.stats as lcstats
+import lambdac.profiler as lcprofiler
+import lambdac.checkpoint as lccheckpoint
+import lambdac.parallel as lcpar
+import lambdac.stdlib as lcstd
 import lambdac.prettyprint as pretty
 
 import magma.tokenize as mgt
 import magma.grammar as mgg
 import magma.to_lambda as mgl
+import magma.optimize as mgo
 
-if len(sys.argv) == 1:
-    print("Invalid Usage: run\033[1;35m magma help\033[1;0m for help")
-    exit(1)
+try:
+    import resource
+except ImportError:
+    # Not on Windows, where --max-memory is not available
+    resource = None
 
-if sys.argv[1] == "compile":
-    if len(sys.argv) < 3:
-        print("No file name provided, try\033[1;35m magma compile file.mg\033[1;0m")
+# Split the command line into positional arguments and --key=value options
+args = [a for a in sys.argv if not a.startswith("--")]
+options = {}
+for a in sys.argv[1:]:
+    if a.startswith("--"):
+        key, _, value = a[2:].partition("=")
+        options[key] = value
+
+engines = {
+    "spine": lcr.SpineReducer,
+    "graph": lcg.GraphReducer, # Shares arguments instead of copying them
+    "debruijn": lcd.DeBruijnReducer, # Works on a compact array based copy of the term
+    "machine": lcm.KrivineMachine, # Environment based abstract machine, no substitution
+    "nbe": lcn.NbEEngine, # Compiles the term to Python closures, does everything in one step
+    "bfs": lcr.BFSReducer, # Reference reducer, for differential testing
+    "parallel": lcpar.ParallelReducer, # Graph reducer normalizing independent arguments in worker processes
+}
+
+# primitives, prelude, binary and trees arguments of the compiler
+def compile_options():
+    for option in ["binary", "trees"]:
+        if option in options and "primitives" in options:
+            # The primitives and their delta rules work on Church numerals and lists
+            print(f"\033[1;35m--primitives\033[1;0m cannot be used with\033[1;35m --{option}\033[1;0m")
+            exit(1)
+    if "binary" in options and "delta" in options:
+        # Nor do the arithmetic rules match the operations on binary numbers, none of them would ever apply
+        print("\033[1;35m--delta\033[1;0m cannot be used with\033[1;35m --binary\033[1;0m")
         exit(1)
-    fname = sys.argv[2]
+    return ["primitives" in options, "prelude" in options, "binary" in options, "trees" in options]
+
+def parse_magma(fname):
     with open(fname) as f:
         src = f.read()
-    tokens = mgt.tokenize(src)
-    indtokens = mgt.indentation_handler(tokens)
-    tree = mgg.parse_tokens(indtokens)
-    lambd = mgl.compile(tree)
-    if len(sys.argv) < 4:
-        print(lambd)
-    else:
-        with open(sys.argv[3], "w", encoding="utf-8") as f:
-            f.write(lambd)
-        print(f"Successfully compiled\033[1;35m {sys.argv[2]}\033[1;0m to\033[1;35m {sys.argv[3]}\033[1;0m")
+    tree = mgg.parse_tokens(mgt.tokenize(src))
+    if "optimize" in options:
+        # What only depends on literals is computed here instead of by reduction
+        tree = mgo.optimize(tree)
+    return tree
+
+# Peak memory of the process so far, in bytes
+def peak_memory():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes, except on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
 
-elif sys.argv[1] == "run":
-    if len(sys.argv) < 3:
-        print("No file name provided, try\033[1;35m magma run file.lc\033[1;0m")
+# Reduces the term of a program with the engine of the options, printing its final state
+# source is the text of the Magma program and lib the stdlib it was compiled with, for --profile
+# resumed is the metadata of the checkpoint the term comes from, if it does
+def execute(tree, source=None, lib=None, resumed=None):
+    engine_name = options.get("engine", "spine")
+    if engine_name not in engines:
+        print(f"Unknown engine\033[1;35m {engine_name}\033[1;0m, pick one of {', '.join(engines)}")
         exit(1)
-    with open(sys.argv[2], encoding="utf-8") as f:
-        src = f.read()
-    tree = lcr.parse_lambda_term(lcp.Stream(lcp.lex(src)))
-    print("|>", pretty.pretty(tree))
-    counter = 0
+    if "delta" in options and not engines[engine_name].delta_rules:
+        print(f"The\033[1;35m {engine_name}\033[1;0m engine has no delta rules, try\033[1;35m --engine=graph\033[1;0m")
+        exit(1)
+    if "memo" in options and not engines[engine_name].memo:
+        print(f"The\033[1;35m {engine_name}\033[1;0m engine has no normal form cache, try\033[1;35m --engine=graph\033[1;0m")
+        exit(1)
+    if "profile" in options and not engines[engine_name].profiling:
+        print(f"The\033[1;35m {engine_name}\033[1;0m engine cannot profile, try\033[1;35m --engine=graph\033[1;0m")
+        exit(1)
+    if "checkpoint" in options and not engines[engine_name].checkpoints:
+        print(f"The\033[1;35m {engine_name}\033[1;0m engine cannot checkpoint, try\033[1;35m --engine=graph\033[1;0m")
+        exit(1)
+    if any(budget in options for budget in ["max-steps", "max-time", "max-memory"]) and not engines[engine_name].budgets:
+        # It does the whole reduction in a single step, which is never cut short
+        print(f"The\033[1;35m {engine_name}\033[1;0m engine cannot be given budgets, try\033[1;35m --engine=graph\033[1;0m")
+        exit(1)
+    if "max-memory" in options and resource is None:
+        print("\033[1;35m--max-memory\033[1;0m is not available on this platform")
+        exit(1)
+    if "delta" not in options or not engines[engine_name].primitives:
+        # Programs compiled with --primitives still run, on the definitions of the primitives
+        lcdelta.define_primitives(tree)
+    if "delta" in options:
+        # Arithmetic on numerals and data structures done natively instead of by reduction
+        lcdelta.mark(tree)
+    arguments = {}
+    if "memo" in options:
+        # Normal forms of closed subterms are remembered, --memo=N keeps the N most recently used ones
+        cache = lcmemo.NormalFormCache(int(options["memo"] or 4096))
+        arguments["cache"] = cache
+    stats = None
+    if "stats" in options:
+        # Telemetry of the reduction, written as JSON to the file of --stats=file.json
+        stats = lcstats.ReductionStats()
+        if engines[engine_name].telemetry:
+            arguments["stats"] = stats
+    if engine_name == "parallel":
+        # --workers=N processes (all the cores by default), given the arguments of at least --grain=N nodes (64)
+        arguments["workers"] = int(options.get("workers") or 0)
+        arguments["grain"] = int(options.get("grain") or 64)
+        arguments["delta_rules"] = "delta" in options
+    profile = None
+    if "profile" in options:
+        # Steps and time by line of the program and by stdlib combinator, --profile=N shows the N largest of each
+        lcprofiler.name_combinators(tree, lib)
+        profile = lcprofiler.Profile()
+        arguments["profile"] = profile
+    # Budgets of this run, it stops once one is used up: --max-steps, --max-time=seconds and --max-memory=MiB (of
+    # the peak memory of the process, loading the program included)
+    max_steps = int(options["max-steps"]) if options.get("max-steps") else None
+    max_time = float(options["max-time"]) if options.get("max-time") else None
+    max_memory = float(options["max-memory"]) * 2**20 if options.get("max-memory") else None
+    # The term is written to the file of --checkpoint every --checkpoint-every seconds (60 by default), and when
+    # the run is stopped by a budget or interrupted, to be carried on with run.py resume
+    checkpoint = (options["checkpoint"] or "checkpoint.lck") if "checkpoint" in options else None
+    every = float(options.get("checkpoint-every") or 60)
+    earlier_steps, earlier_time = (resumed["steps"], resumed["time"]) if resumed is not None else (0, 0.0)
+    engine = engines[engine_name](tree, **arguments)
     total_steps = 0
 
+    def save(elapsed):
+        lccheckpoint.write(checkpoint, engine.term, {
+            "engine": engine_name,
+            "steps": earlier_steps + total_steps,
+            "time": earlier_time + elapsed,
+            # Options the engine runs with, the term is already compiled
+            "options": {name: options[name] for name in ["delta", "memo"] if name in options},
+        })
+
     t0 = time.perf_counter()
-    while lcr.perform_reduction(tree):
-        total_steps += 1
-        if total_steps % 200 == 0:
-            print(total_steps, "steps ran")
+    saved = t0
+    stopped = None
+    if stats is not None:
+        stats.start(engine)
+    if profile is not None:
+        profile.start()
+    try:
+        while True:
+            # Looked at before stepping, so that --max-steps=0 does not take any
+            if total_steps == max_steps:
+                stopped = "step budget used up"
+                break
+            if not engine.step():
+                break
+            total_steps += 1
+            if stats is not None and total_steps % 64 == 0:
+                stats.progress(total_steps)
+            if total_steps % 200 == 0:
+                print(total_steps, engine.unit, "ran")
+            # The clock and the memory are only looked at every so often
+            if total_steps % 64 == 0 and (max_time, max_memory, checkpoint) != (None, None, None):
+                now = time.perf_counter()
+                if max_time is not None and now - t0 >= max_time:
+                    stopped = "time budget used up"
+                    break
+                if max_memory is not None and peak_memory() >= max_memory:
+                    stopped = "memory budget used up"
+                    break
+                if checkpoint is not None and now - saved >= every:
+                    save(now - t0)
+                    saved = time.perf_counter()
+    except KeyboardInterrupt:
+        # The step being done is dropped: engines only change the term once a step has its result
+        stopped = "interrupted"
     t1 = time.perf_counter()
-    print("β>", pretty.pretty(tree))
-    lcr.render_state_printer(tree)
-    print(f"Executed in {total_steps} steps")
-    print(f"Took {t1-t0:2f} seconds")
\ No newline at end of file
+    if stats is not None:
+        stats.finish(total_steps)
+    if stopped is not None:
+        print(f"Stopped after {earlier_steps + total_steps} {engine.unit}: {stopped}")
+        if checkpoint is not None:
+            save(t1 - t0)
+            print(f"Checkpoint written to\033[1;35m {checkpoint}\033[1;0m, carry on with\033[1;35m magma resume {checkpoint}\033[1;0m")
+    else:
+        # Engines which do not reduce one step at a time count their own work
+        total_steps = earlier_steps + getattr(engine, "steps", total_steps)
+        tree = engine.term
+        print("β>", pretty.pretty(tree))
+        lcr.render_state_printer(tree)
+        print(f"Executed in {total_steps} {engine.unit}")
+        if "memo" in options:
+            print(f"Normal form cache: {cache.hits} hits, {cache.misses} misses, {cache.evictions} evictions")
+        print(f"Took {t1-t0:2f} seconds" + (f", {earlier_time + t1 - t0:2f} with the runs before" if resumed else ""))
+    # Telemetry and profile of what was done, the runs stopped early included
+    if stats is not None:
+        stats.write(options["stats"] or "stats.json")
+        print(f"Reduction statistics written to\033[1;35m {options['stats'] or 'stats.json'}\033[1;0m")
+    if profile is not None:
+        print(profile.report(source and source.splitlines(), int(options["profile"] or 20)))
+    if stopped is not None:
+        exit(2)
+
+# Only as a script: the worker processes of the parallel engine may import this file again
+if __name__ == "__main__":
+    if len(args) == 1:
+        print("Invalid Usage: run\033[1;35m magma help\033[1;0m for help")
+        exit(1)
+
+    if args[1] == "compile":
+        if len(args) < 3:
+            print("No file name provided, try\033[1;35m magma compile file.mg\033[1;0m")
+            exit(1)
+        tree = parse_magma(args[2])
+        if len(args) >= 4 and args[3].endswith(".lcb"):
+            # Binary output: the term is built directly, with its repeated combinators stored once
+            lcbin.write(mgl.compile_term(tree, *compile_options()), args[3])
+        else:
+            lambd = mgl.compile(tree, *compile_options())
+            if len(args) < 4:
+                print(lambd)
+            else:
+                with open(args[3], "w", encoding="utf-8") as f:
+                    f.write(lambd)
+        if len(args) >= 4:
+            print(f"Successfully compiled\033[1;35m {args[2]}\033[1;0m to\033[1;35m {args[3]}\033[1;0m")
+
+    elif args[1] == "run":
+        if len(args) < 3:
+            print("No file name provided, try\033[1;35m magma run file.lc\033[1;0m")
+            exit(1)
+        if args[2].endswith(".lcb"):
+            # Already interned when compiled
+            tree = lcbin.read(args[2])
+            print("|>", pretty.pretty(tree))
+        else:
+            # Tokens are read from the file as the parser asks for them
+            with open(args[2], "rb") as f:
+                tree = lcr.parse_lambda_term(lcp.Stream(lcp.tokens(f)))
+            print("|>", pretty.pretty(tree))
+            # The compiled program repeats the same combinators over and over, they are only kept once
+            tree = lcp.InternTable().intern(tree)
+        execute(tree)
+
+    elif args[1] == "resume":
+        if len(args) < 3:
+            print("No checkpoint provided, try\033[1;35m magma resume checkpoint.lck\033[1;0m")
+            exit(1)
+        tree, resumed = lccheckpoint.read(args[2])
+        # Carried on as it was run, unless the options say otherwise, and checkpointed to the same file
+        options.setdefault("engine", resumed["engine"])
+        for name, value in resumed["options"].items():
+            options.setdefault(name, value)
+        options.setdefault("checkpoint", args[2])
+        print(f"Resuming after {resumed['steps']} steps and {resumed['time']:2f} seconds")
+        execute(tree, resumed=resumed)
+
+    elif args[1] == "exec":
+        if len(args) < 3:
+            print("No file name provided, try\033[1;35m magma exec file.mg\033[1;0m")
+            exit(1)
+        # Compiled and run in the same process, the term is never written out as text and parsed back
+        primitives, prelude, binary, trees = compile_options()
+        tree = mgl.compile_term(parse_magma(args[2]), primitives, prelude, binary, trees)
+        print("|>", pretty.pretty(tree))
+        with open(args[2]) as f:
+            execute(tree, f.read(), lcstd.libraries[binary, trees])